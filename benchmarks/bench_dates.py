@@ -0,0 +1,65 @@
+"""
+日付変換のベンチマーク（従来の行単位変換と parse_journal_dates の比較）
+
+    python benchmarks/bench_dates.py [行数]
+"""
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from henkan_core import parse_journal_dates
+
+
+def wareki_to_date_simple(date_str):
+    # 従来の load_file() 内の変換（比較用）
+    if isinstance(date_str, str) and date_str.startswith("R."):
+        try:
+            date_str = date_str.replace("R.", "")
+            year, month, day = map(int, date_str.split("/"))
+            seireki_year = 2018 + year
+            return f"{seireki_year}/{month:02d}/{day:02d}"
+        except:
+            return date_str
+    return date_str
+
+
+def legacy_parse(values):
+    dates = values.apply(wareki_to_date_simple)
+    dates = pd.to_datetime(dates, errors="coerce").dt.date
+    # 従来は henkan.py 側でもう一度変換していた
+    return pd.to_datetime(dates, errors="coerce").dt.date
+
+
+def make_dates(rows, seed=0):
+    rnd = random.Random(seed)
+    return pd.Series(
+        [f"R.{rnd.randint(1, 7):02d}/{rnd.randint(1, 12):02d}/{rnd.randint(1, 28):02d}" for _ in range(rows)],
+        dtype=object,
+    )
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    values = make_dates(rows)
+
+    legacy_seconds, legacy = timed(legacy_parse, values)
+    new_seconds, (parsed, unparsed) = timed(parse_journal_dates, values)
+
+    print(f"行数: {rows}")
+    print(f"従来（apply + to_datetime×2）: {legacy_seconds:.3f}秒")
+    print(f"parse_journal_dates        : {new_seconds:.3f}秒（{legacy_seconds / new_seconds:.1f}倍）")
+    print(f"結果一致: {bool((legacy == parsed).all())} / 変換不可: {int(unparsed.sum())}件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+仕訳変換の各段階（読み込み・日付変換・諸口補完・科目/税区分/補助科目の割り当て・CSV出力）のベンチマーク
+
+    python benchmarks/bench_pipeline.py                       # 1千 / 1万 / 10万 / 100万行
+    python benchmarks/bench_pipeline.py --sizes 1000 10000 --repeat 5
+    python benchmarks/bench_pipeline.py --compare /tmp/yayoi_r4_bench/results/前回の結果.json
+
+合成データは synthetic.py で作成し、--data-dir に保存して次回以降も使い回します。
+結果は JSON で --data-dir の results に保存します（各段階の最小時間と全回の時間。リポジトリの中には書き込まない）。--compare を指定すると前回の結果と比較します。
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+from file_encoding import detect_stream_encoding
+from henkan_core import (
+    TEXT_DTYPES, prepare_yayoi_frame, normalize_journal, load_masters, new_df_book,
+    map_accounts, map_taxes, update_df_book, write_r4_csv
+)
+from synthetic import create_master_db, write_journal_csv
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+STAGES = ["parse", "dates", "normalize", "accounts", "taxes", "hojo", "export"]
+# 前回より遅くなったとみなす比率（計測誤差が大きい短時間の段階は対象外）
+REGRESSION_THRESHOLD = 1.2
+MIN_COMPARABLE_SECONDS = 0.01
+
+
+def run_pipeline(csv_path, masters):
+    """ 変換を1回実行し、段階ごとの所要時間（秒）を返す """
+    timings = {}
+
+    def stage(name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        timings[name] = time.perf_counter() - start
+        return result
+
+    def parse():
+        # read_yayoi_file と同じ読み込み（文字コード判定はキャッシュを使わない）
+        with open(csv_path, "rb") as f:
+            raw_data = f.read()
+        encoding = detect_stream_encoding(io.BytesIO(raw_data))
+        return pd.read_csv(io.BytesIO(raw_data), header=None, dtype=TEXT_DTYPES,
+                           encoding=encoding, encoding_errors="replace")
+
+    df = stage("parse", parse)
+    df = stage("dates", prepare_yayoi_frame, df)
+    stage("normalize", normalize_journal, df, masters["rules"])
+    df_book = stage("accounts", lambda: map_accounts(df, new_df_book(df), masters["kamoku"]))
+    stage("taxes", map_taxes, df, df_book, masters["syouhizei"])
+    stage("hojo", update_df_book, df, df_book, masters["hojo"], masters["rules"])
+    stage("export", write_r4_csv, df_book, io.BytesIO())
+    return timings
+
+
+def benchmark_size(rows, data_dir, db_path, repeat, seed):
+    csv_path = os.path.join(data_dir, f"synthetic_{rows}_{seed}.csv")
+    if not os.path.exists(csv_path):
+        print(f"  合成データを作成しています（{rows}行）...")
+        write_journal_csv(csv_path, rows, seed)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        start = time.perf_counter()
+        masters = load_masters(conn)
+        masters_seconds = time.perf_counter() - start
+    finally:
+        conn.close()
+
+    runs = [run_pipeline(csv_path, masters) for _ in range(repeat)]
+    stages = {"masters": {"min": masters_seconds, "runs": [masters_seconds]}}
+    for name in STAGES:
+        seconds = [run[name] for run in runs]
+        stages[name] = {"min": min(seconds), "runs": seconds}
+    total = min(sum(run.values()) for run in runs)
+    return {
+        "rows": rows,
+        "file_bytes": os.path.getsize(csv_path),
+        "total_seconds": total,
+        "rows_per_second": rows / total,
+        "stages": stages,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+
+def print_results(results):
+    header = f"{'行数':>10} " + " ".join(f"{name:>10}" for name in ["masters"] + STAGES) + f" {'合計':>10} {'行/秒':>12}"
+    print(header)
+    for result in results:
+        stages = " ".join(f"{result['stages'][name]['min']:>10.4f}" for name in ["masters"] + STAGES)
+        print(f"{result['rows']:>10,} {stages} {result['total_seconds']:>10.4f} {result['rows_per_second']:>12,.0f}")
+
+
+def compare_results(baseline, results):
+    """ 前回の結果と段階ごとに比較し、遅くなった段階の数を返す """
+    baseline_by_rows = {result["rows"]: result for result in baseline["results"]}
+    commit = baseline["environment"].get("git_commit") or "不明"
+    print(f"\n前回（{baseline['created']} / {commit}）との比較（今回 / 前回）")
+    regressions = 0
+    for result in results:
+        previous = baseline_by_rows.get(result["rows"])
+        if previous is None:
+            continue
+        cells = []
+        for name in ["masters"] + STAGES + ["total"]:
+            if name == "total":
+                current_seconds, previous_seconds = result["total_seconds"], previous["total_seconds"]
+            elif name in previous["stages"]:
+                current_seconds, previous_seconds = result["stages"][name]["min"], previous["stages"][name]["min"]
+            else:
+                continue
+            ratio = current_seconds / previous_seconds if previous_seconds else float("inf")
+            mark = ""
+            if ratio > REGRESSION_THRESHOLD and max(current_seconds, previous_seconds) >= MIN_COMPARABLE_SECONDS:
+                mark = " ▲"
+                regressions += 1
+            cells.append(f"{name} {ratio:.2f}x{mark}")
+        print(f"{result['rows']:>10,}: " + " / ".join(cells))
+    if regressions:
+        print(f"▲ {REGRESSION_THRESHOLD}倍以上遅くなった段階が {regressions} 件あります。")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="仕訳変換の段階ごとの処理時間を計測します。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="計測する行数")
+    parser.add_argument("--repeat", type=int, default=3, help="各行数の実行回数（最小時間を採用。既定: 3）")
+    parser.add_argument("--seed", type=int, default=0, help="合成データの乱数シード（既定: 0）")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "yayoi_r4_bench"),
+                        help="合成データの保存先（既定: 一時ディレクトリ）")
+    parser.add_argument("--output", help="結果のJSONの出力先（既定: <data-dir>/results/pipeline_<日時>.json）")
+    parser.add_argument("--compare", help="比較する前回の結果のJSON")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    db_path = os.path.join(args.data_dir, "synthetic_masters.db")
+    create_master_db(db_path)
+
+    results = []
+    for rows in args.sizes:
+        print(f"{rows}行を計測しています...")
+        results.append(benchmark_size(rows, args.data_dir, db_path, args.repeat, args.seed))
+
+    created = datetime.now()
+    report = {
+        "benchmark": "pipeline",
+        "created": created.isoformat(timespec="seconds"),
+        "environment": environment(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": results,
+    }
+    output = args.output or os.path.join(args.data_dir, "results", f"pipeline_{created:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print()
+    print_results(results)
+    print(f"\n結果を保存しました: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        return 1 if compare_results(baseline, results) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+XLSX の読み込み（pd.read_excel と xlsx_reader.read_xlsx）のベンチマーク
+
+    python benchmarks/bench_xlsx.py                       # 1千 / 1万 / 10万行
+    python benchmarks/bench_xlsx.py --sizes 100000 --repeat 1
+
+合成データは synthetic.py で Excel と同じ形式（共有文字列）のXLSXとして作成し、--data-dir に保存して使い回します。
+read_xlsx はキャッシュを消去した状態（初回）と、同じ内容を読み直した場合（キャッシュ）の両方を計測し、
+読み込み結果が pd.read_excel と一致することも確認します。結果は JSON で --data-dir の results に保存します。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+from xlsx_reader import read_xlsx, clear_xlsx_cache
+from bench_pipeline import environment
+from synthetic import write_journal_xlsx
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def _min_seconds(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+
+def benchmark_size(rows, data_dir, repeat, seed):
+    xlsx_path = os.path.join(data_dir, f"synthetic_{rows}_{seed}.xlsx")
+    if not os.path.exists(xlsx_path):
+        print(f"  合成データを作成しています（{rows}行）...")
+        write_journal_xlsx(xlsx_path, rows, seed)
+
+    read_excel_seconds, expected = _min_seconds(lambda: pd.read_excel(xlsx_path, header=None), repeat)
+
+    def cold():
+        clear_xlsx_cache()
+        return read_xlsx(xlsx_path)
+
+    read_xlsx_seconds, actual = _min_seconds(cold, repeat)
+    cached_seconds, _ = _min_seconds(lambda: read_xlsx(xlsx_path), repeat)
+    pd.testing.assert_frame_equal(expected, actual)
+    return {
+        "rows": rows,
+        "file_bytes": os.path.getsize(xlsx_path),
+        "read_excel_seconds": read_excel_seconds,
+        "read_xlsx_seconds": read_xlsx_seconds,
+        "cached_seconds": cached_seconds,
+        "speedup": read_excel_seconds / read_xlsx_seconds,
+    }
+
+
+def print_results(results):
+    print(f"{'行数':>10} {'ファイル(MB)':>12} {'read_excel':>12} {'read_xlsx':>12} {'キャッシュ':>12} {'倍率':>8}")
+    for result in results:
+        print(f"{result['rows']:>10,} {result['file_bytes'] / 1024 / 1024:>12.1f} {result['read_excel_seconds']:>12.3f} "
+              f"{result['read_xlsx_seconds']:>12.3f} {result['cached_seconds']:>12.4f} {result['speedup']:>7.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="XLSX の読み込み時間を pd.read_excel と比較します。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="計測する行数")
+    parser.add_argument("--repeat", type=int, default=3, help="各行数の実行回数（最小時間を採用。既定: 3）")
+    parser.add_argument("--seed", type=int, default=0, help="合成データの乱数シード（既定: 0）")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "yayoi_r4_bench"),
+                        help="合成データの保存先（既定: 一時ディレクトリ）")
+    parser.add_argument("--output", help="結果のJSONの出力先（既定: <data-dir>/results/xlsx_<日時>.json）")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for rows in args.sizes:
+        print(f"{rows}行を計測しています...")
+        results.append(benchmark_size(rows, args.data_dir, args.repeat, args.seed))
+
+    created = datetime.now()
+    report = {
+        "benchmark": "xlsx",
+        "created": created.isoformat(timespec="seconds"),
+        "environment": environment(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": results,
+    }
+    output = args.output or os.path.join(args.data_dir, "results", f"xlsx_{created:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print()
+    print_results(results)
+    print(f"\n結果を保存しました: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+ベンチマーク用の合成データ（弥生会計の仕訳CSVと、対応するマスタDB）を作成する
+
+    python benchmarks/synthetic.py --rows 100000 --csv 仕訳.csv --db masters.db
+
+仕訳は弥生会計インポート形式の25列（cp932）で、次を含みます。
+- 「R.06/04/01」形式の和暦日付
+- 複数行の伝票（片側が空欄で、変換時に「諸口」で補完される行）
+- 補助科目が「賃貸収入」の行
+- 複数の税区分（一部はマスタ未登録）
+"""
+import argparse
+import csv
+import os
+import random
+import sqlite3
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import initialize_tables
+
+# (弥生会計科目名, 財務R4科目コード, 財務R4科目名)
+ACCOUNTS = [
+    ("現金", "101", "現金"),
+    ("普通預金", "131", "普通預金"),
+    ("売掛金", "151", "売掛金"),
+    ("仮払消費税", "190", "仮払消費税"),
+    ("買掛金", "310", "買掛金"),
+    ("未払金", "320", "未払金"),
+    ("仮受消費税", "340", "仮受消費税"),
+    ("材料仕入高", "401", "材料仕入高"),
+    ("C消耗品費", "435", "C消耗品費"),
+    ("C外注加工費", "448", "C外注加工費"),
+    ("旅費交通費", "520", "旅費交通費"),
+    ("通信費", "521", "通信費"),
+    ("水道光熱費", "525", "水道光熱費"),
+    ("支払手数料", "530", "支払手数料"),
+    ("売上高", "800", "売上高"),
+    ("商品売上高", "810", "商品売上高"),
+    ("賃貸収入", "820", "賃貸収入"),
+    ("諸口", "999", "諸口"),
+]
+
+# (財務R4科目名, 財務R4補助科目コード, 財務R4補助科目名, 弥生会計補助科目名)
+SUB_ACCOUNTS = [
+    ("普通預金", "1", "A銀行", "A銀行"),
+    ("普通預金", "2", "B銀行", "B銀行"),
+    ("売掛金", "1", "得意先A", "得意先A"),
+    ("売掛金", "2", "得意先B", "得意先B"),
+    ("買掛金", "1", "仕入先A", "仕入先A"),
+    ("商品売上高", "1", "店舗", "店舗"),
+]
+
+# (弥生会計税区分, 財務R4税コード, 財務R4税率, 財務R4インボイス, 財務R4簡易課税)
+TAX_CLASSES = [
+    ("課税売上込10%", "10", "10", "1", None),
+    ("課税売上込軽減8%", "12", "8", "1", None),
+    ("課対仕入込10%", "20", "10", "1", None),
+    ("課対仕入込軽減8%", "22", "8", "1", None),
+    ("課対仕入込10%区分80%", "24", "10", "2", None),
+    ("非課売上", "30", None, None, None),
+    ("対象外", "0", None, None, None),
+]
+
+# マスタに登録しない値（実データで起こる未登録の科目・税区分）
+UNREGISTERED_ACCOUNTS = ["雑費", "新規科目"]
+UNREGISTERED_TAX_CLASSES = ["課税売上込5%"]
+
+_EXPENSES = ["旅費交通費", "通信費", "水道光熱費", "支払手数料", "材料仕入高", "C消耗品費", "C外注加工費"]
+_PAYMENTS = [("現金", ""), ("普通預金", "A銀行"), ("普通預金", "B銀行"), ("未払金", ""), ("買掛金", "仕入先A")]
+_DESCRIPTIONS = ["タクシー代", "電話料金", "電気料金", "振込手数料", "材料代", "事務用品", "外注費", "売上計上"]
+
+
+def create_master_db(path):
+    """ 合成データの科目・補助科目・税区分をすべて登録したマスタDBを作る """
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        initialize_tables(conn)
+        with conn:
+            conn.executemany(
+                "INSERT INTO kamoku_master VALUES (?, ?, ?, ?)",
+                [(f"k{i}", code, name, yayoi) for i, (yayoi, code, name) in enumerate(ACCOUNTS)],
+            )
+            codes = {name: code for _, code, name in ACCOUNTS}
+            conn.executemany(
+                "INSERT INTO hojo_master VALUES (?, ?, ?, ?, ?, ?)",
+                [(f"h{i}", codes[account], account, sub_code, sub_name, yayoi)
+                 for i, (account, sub_code, sub_name, yayoi) in enumerate(SUB_ACCOUNTS)],
+            )
+            conn.executemany(
+                "INSERT INTO syouhizei_master VALUES (?, ?, ?, ?, ?, ?)",
+                [(f"t{i}", code, rate, invoice, simple, yayoi)
+                 for i, (yayoi, code, rate, invoice, simple) in enumerate(TAX_CLASSES)],
+            )
+    finally:
+        conn.close()
+
+
+def _line(flag, slip_no, date, debit, credit, amount, description):
+    # debit / credit: (勘定科目, 補助科目, 税区分)。None の側は空欄（複数行伝票の片側）
+    tax = amount * 10 // 110
+    row = [flag, slip_no, "", date]
+    for side in (debit, credit):
+        if side is None:
+            row += ["", "", "", "", "", ""]
+        else:
+            account, sub_account, tax_class = side
+            row += [account, sub_account, "", tax_class, amount, tax if tax_class.startswith("課") else 0]
+    row += [description, "", "", 0, "", "", 0, 0, "no"]
+    return row
+
+
+def iter_journal_rows(rows, seed=0, unregistered_ratio=0.01):
+    """ 弥生会計インポート形式（25列）の仕訳行を rows 行生成する """
+    rnd = random.Random(seed)
+    slip_no = 0
+    produced = 0
+    while produced < rows:
+        slip_no += 1
+        date = f"R.{rnd.randint(5, 7):02d}/{rnd.randint(1, 12):02d}/{rnd.randint(1, 28):02d}"
+        description = rnd.choice(_DESCRIPTIONS)
+        kind = rnd.random()
+
+        if kind < 0.55:
+            # 経費の支払い
+            expense = rnd.choice(_EXPENSES)
+            if rnd.random() < unregistered_ratio:
+                expense = rnd.choice(UNREGISTERED_ACCOUNTS)
+            tax_class = rnd.choice(["課対仕入込10%", "課対仕入込軽減8%", "課対仕入込10%区分80%"])
+            if rnd.random() < unregistered_ratio:
+                tax_class = rnd.choice(UNREGISTERED_TAX_CLASSES)
+            account, sub_account = rnd.choice(_PAYMENTS)
+            lines = [("2000", (expense, "", tax_class), (account, sub_account, "対象外"), rnd.randint(100, 200_000))]
+        elif kind < 0.75:
+            # 売上（一部は補助科目「賃貸収入」）
+            sub_account = "賃貸収入" if rnd.random() < 0.3 else rnd.choice(["店舗", ""])
+            credit = ("商品売上高" if sub_account == "店舗" else "売上高", sub_account,
+                      rnd.choice(["課税売上込10%", "課税売上込軽減8%", "非課売上"]))
+            debit = ("売掛金", rnd.choice(["得意先A", "得意先B"]), "対象外")
+            lines = [("2000", debit, credit, rnd.randint(1_000, 1_000_000))]
+        else:
+            # 複数行の伝票（借方を複数行に分け、貸方は最終行にまとめる）
+            count = rnd.randint(2, 4)
+            amounts = [rnd.randint(100, 50_000) for _ in range(count)]
+            account, sub_account = rnd.choice(_PAYMENTS)
+            lines = [("2100", (rnd.choice(_EXPENSES), "", rnd.choice(["課対仕入込10%", "課対仕入込軽減8%"])), None, amount)
+                     for amount in amounts]
+            lines.append(("2101", None, (account, sub_account, "対象外"), sum(amounts)))
+            # 先頭行は 2110、最終行は 2101
+            lines[0] = ("2110",) + lines[0][1:]
+
+        for flag, debit, credit, amount in lines:
+            if produced >= rows:
+                break
+            yield _line(flag, slip_no, date, debit, credit, amount, description)
+            produced += 1
+
+
+def write_journal_csv(path, rows, seed=0, encoding="cp932"):
+    """ 合成した仕訳を弥生会計のエクスポートと同じ形式（ヘッダーなしCSV）で書き出す """
+    with open(path, "w", newline="", encoding=encoding) as f:
+        csv.writer(f).writerows(iter_journal_rows(rows, seed))
+
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="仕訳日記帳" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" '
+        'Target="sharedStrings.xml"/>'
+        '<Relationship Id="rId3" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="游ゴシック"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="標準" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+
+def _column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def write_journal_xlsx(path, rows, seed=0):
+    """ 合成した仕訳を、Excel で保存した形式（共有文字列を使うXLSX）で書き出す。内容は write_journal_csv と同じ """
+    letters = [_column_letter(i) for i in range(25)]
+    strings = {}
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in _XLSX_PARTS.items():
+            zf.writestr(name, xml)
+        with zf.open("xl/worksheets/sheet1.xml", "w") as f:
+            f.write(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                f'<dimension ref="A1:Y{rows}"/><sheetData>'.encode()
+            )
+            for r, row in enumerate(iter_journal_rows(rows, seed), start=1):
+                cells = []
+                for letter, value in zip(letters, row):
+                    if value == "":
+                        continue
+                    if isinstance(value, int):
+                        cells.append(f'<c r="{letter}{r}"><v>{value}</v></c>')
+                    else:
+                        index = strings.setdefault(value, len(strings))
+                        cells.append(f'<c r="{letter}{r}" t="s"><v>{index}</v></c>')
+                f.write(f'<row r="{r}">{"".join(cells)}</row>'.encode())
+            f.write(b"</sheetData></worksheet>")
+        zf.writestr("xl/sharedStrings.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" uniqueCount="{len(strings)}">'
+            + "".join(f"<si><t>{escape(value)}</t></si>" for value in strings)
+            + "</sst>"
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベンチマーク用の弥生会計仕訳CSVとマスタDBを作成します。")
+    parser.add_argument("--rows", type=int, default=10_000, help="仕訳の行数（既定: 10000）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード（既定: 0）")
+    parser.add_argument("--csv", default="synthetic_journal.csv", help="仕訳CSVの出力先")
+    parser.add_argument("--db", default="synthetic_masters.db", help="マスタDBの出力先")
+    args = parser.parse_args(argv)
+
+    write_journal_csv(args.csv, args.rows, args.seed)
+    create_master_db(args.db)
+    print(f"{args.csv}（{args.rows}行）と {args.db} を作成しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+# 接続ごとに設定する PRAGMA（設定順）
+PERFORMANCE_PRAGMAS = [
+    # 読み取り中でも書き込みを待たせない（設定はファイルに保存される）
+    ("journal_mode", "WAL"),
+    # WAL では NORMAL でもデータベースは壊れない（電源断時に直前のコミットが失われることはある）
+    ("synchronous", "NORMAL"),
+    # ページキャッシュ 16 MiB（負の値は KiB 単位）
+    ("cache_size", -16 * 1024),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+    # ロック中は最大 5 秒まで待つ
+    ("busy_timeout", 5000),
+]
+
+# 使われなくなった接続を閉じるまでの時間
+DEFAULT_MAX_IDLE_SECONDS = 5 * 60
+
+
+def open_connection(db_path, pragmas=PERFORMANCE_PRAGMAS):
+    """ PRAGMA を設定した新しい接続を開く（プールを使わない用途向け） """
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for name, value in pragmas:
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class _PooledConnection:
+    def __init__(self, conn, owner):
+        self.conn = conn
+        self.owner = weakref.ref(owner)
+        self.last_used = time.monotonic()
+
+    def owner_alive(self):
+        owner = self.owner()
+        return owner is not None and owner.is_alive()
+
+
+class ConnectionManager:
+    """
+    データベースごと・スレッドごとに接続を貸し出す（プロセス全体で共有）。
+    終了したスレッドの接続は次のスレッドに引き継ぎ、一定時間使われなければ閉じる
+    """
+
+    def __init__(self, pragmas=PERFORMANCE_PRAGMAS, max_idle_seconds=DEFAULT_MAX_IDLE_SECONDS):
+        self.pragmas = pragmas
+        self.max_idle_seconds = max_idle_seconds
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, db_path):
+        """ 呼び出したスレッド用の db_path への接続を返す """
+        key = os.path.abspath(db_path)
+        thread = threading.current_thread()
+        now = time.monotonic()
+        with self._lock:
+            self._close_idle(now)
+            pool = self._pools.setdefault(key, [])
+            pooled = next((p for p in pool if p.owner() is thread), None)
+            if pooled is None:
+                # Streamlit は再実行ごとにスレッドが変わるため、終了したスレッドの接続を使い回す
+                pooled = next((p for p in pool if not p.owner_alive()), None)
+                if pooled is not None:
+                    pooled.owner = weakref.ref(thread)
+                    if pooled.conn.in_transaction:
+                        pooled.conn.rollback()
+            if pooled is not None:
+                pooled.last_used = now
+                return pooled.conn
+
+        conn = open_connection(key, self.pragmas)
+        with self._lock:
+            self._pools.setdefault(key, []).append(_PooledConnection(conn, thread))
+        return conn
+
+    def close(self, db_path=None):
+        """ 指定したデータベース（省略時はすべて）の接続を閉じる。ファイルを置き換える前に呼ぶ """
+        with self._lock:
+            keys = list(self._pools) if db_path is None else [os.path.abspath(db_path)]
+            for key in keys:
+                for pooled in self._pools.pop(key, []):
+                    pooled.conn.close()
+
+    def close_idle(self):
+        """ 終了したスレッドの接続のうち、一定時間使われていないものを閉じる """
+        with self._lock:
+            self._close_idle(time.monotonic())
+
+    def _close_idle(self, now):
+        for key in list(self._pools):
+            pool = self._pools[key]
+            for pooled in [p for p in pool if not p.owner_alive() and now - p.last_used > self.max_idle_seconds]:
+                pooled.conn.close()
+                pool.remove(pooled)
+            if not pool:
+                del self._pools[key]
+
+
+_manager = ConnectionManager()
+
+
+def get_connection(db_path):
+    return _manager.get(db_path)
+
+
+def close_connections(db_path=None):
+    _manager.close(db_path)
@@ -0,0 +1,351 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+from henkan_rules import RULE_COLUMNS, default_rule_rows
+from lookup_keys import normalize_lookup_keys
+
+# 変換に使うマスタ（master_cache が変更を検知する対象）
+MASTER_REVISION_TABLES = ["kamoku_master", "hojo_master", "syouhizei_master", "henkan_rules"]
+
+# スキーマの変更履歴。i 番目の要素を適用すると PRAGMA user_version が i + 1 になる。
+# 既存のデータベースは接続時に未適用の版だけが順に適用される（変更を加える場合は末尾に追加する）
+SCHEMA_MIGRATIONS = [
+    # 1: マスタテーブル
+    [
+        """
+        CREATE TABLE IF NOT EXISTS kamoku_master (
+            管理番号 TEXT PRIMARY KEY,
+            財務R4科目コード TEXT NOT NULL,
+            財務R4科目名 TEXT NOT NULL,
+            弥生会計科目名 TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS hojo_master (
+            管理番号 TEXT PRIMARY KEY,
+            財務R4科目コード TEXT NOT NULL,
+            財務R4科目名 TEXT NOT NULL,
+            財務R4補助科目コード TEXT NOT NULL,
+            財務R4補助科目名 TEXT,
+            弥生会計補助科目名 TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS syouhizei_master (
+            管理番号 TEXT PRIMARY KEY,
+            財務R4税コード TEXT NOT NULL,
+            財務R4税率 TEXT,
+            財務R4インボイス TEXT,
+            財務R4簡易課税 TEXT,
+            弥生会計税区分 TEXT
+        )
+        """,
+    ],
+    # 2: 仕訳変換・設定画面で照合に使う列の索引
+    [
+        "CREATE INDEX IF NOT EXISTS idx_kamoku_master_yayoi ON kamoku_master (弥生会計科目名)",
+        "CREATE INDEX IF NOT EXISTS idx_kamoku_master_r4_code ON kamoku_master (財務R4科目コード)",
+        "CREATE INDEX IF NOT EXISTS idx_hojo_master_r4_yayoi ON hojo_master (財務R4科目名, 弥生会計補助科目名)",
+        "CREATE INDEX IF NOT EXISTS idx_syouhizei_master_yayoi ON syouhizei_master (弥生会計税区分)",
+    ],
+    # 3: 変換履歴（変換済みの仕訳行の指紋。前月までに変換した仕訳を除いて出力するために使う）
+    [
+        """
+        CREATE TABLE IF NOT EXISTS henkan_ledger (
+            伝票番号 INTEGER NOT NULL,
+            行番号 INTEGER NOT NULL,
+            指紋 INTEGER NOT NULL,
+            変換日時 TEXT NOT NULL,
+            PRIMARY KEY (伝票番号, 行番号)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 4: 変換ルール（諸口・賃貸収入・補助の既定値などの特例。既定のルールを登録する）
+    [
+        """
+        CREATE TABLE IF NOT EXISTS henkan_rules (
+            管理番号 TEXT PRIMARY KEY,
+            順序 INTEGER NOT NULL,
+            段階 TEXT NOT NULL,
+            貸借 TEXT DEFAULT '両方',
+            条件列 TEXT,
+            条件 TEXT,
+            条件値 TEXT,
+            条件列2 TEXT,
+            条件2 TEXT,
+            条件値2 TEXT,
+            設定列 TEXT NOT NULL,
+            設定方法 TEXT DEFAULT '値',
+            設定値 TEXT,
+            有効 INTEGER DEFAULT 1,
+            説明 TEXT
+        )
+        """,
+        (
+            f"INSERT OR IGNORE INTO henkan_rules ({', '.join(RULE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in RULE_COLUMNS)})",
+            default_rule_rows(),
+        ),
+    ],
+    # 5: マスタ・変換ルールの改版番号（変更のたびにトリガーで増やす。変換履歴の書き込みでは変わらない）
+    [
+        """
+        CREATE TABLE IF NOT EXISTS master_revision (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            改版番号 INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO master_revision (id, 改版番号) VALUES (1, 0)",
+        *(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_revision AFTER {event} ON {table}
+            BEGIN UPDATE master_revision SET 改版番号 = 改版番号 + 1; END
+            """
+            for table in MASTER_REVISION_TABLES
+            for event in ("INSERT", "UPDATE", "DELETE")
+        ),
+    ],
+]
+
+# 仕訳変換で照合に使うキー（重複している場合は先頭の行が使われる）
+LOOKUP_KEYS = {
+    "kamoku_master": ["弥生会計科目名"],
+    "hojo_master": ["財務R4科目名", "弥生会計補助科目名"],
+    "syouhizei_master": ["弥生会計税区分"],
+}
+
+
+def initialize_tables(conn):
+    """ データベースのスキーマを最新の版に更新する。最新であれば PRAGMA を1回読むだけ """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target_version in range(version + 1, len(SCHEMA_MIGRATIONS) + 1):
+        with conn:
+            conn.execute("BEGIN")
+            for statement in SCHEMA_MIGRATIONS[target_version - 1]:
+                # (SQL, 行のリスト) は行ごとに実行する
+                if isinstance(statement, tuple):
+                    conn.executemany(*statement)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target_version}")
+
+
+def read_master_revision(conn):
+    """ マスタ・変換ルールの改版番号を返す（スキーマが古く改版番号がない場合は None） """
+    try:
+        row = conn.execute("SELECT 改版番号 FROM master_revision").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+@lru_cache(maxsize=1)
+def empty_database_bytes():
+    """ 最新のスキーマで作成した空のデータベースをバイト列で返す（プロセスごとに1回だけ作成する） """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "empty.db")
+        conn = sqlite3.connect(path)
+        try:
+            initialize_tables(conn)
+        finally:
+            conn.close()
+        with open(path, "rb") as f:
+            return f.read()
+
+
+# 整合性チェックの結果（内容のハッシュ値ごと。同じ内容のファイルは1回だけ検査する）。
+# 長時間動かしても増え続けないよう、最近使った INTEGRITY_CACHE_SIZE 件だけを残す
+INTEGRITY_CACHE_SIZE = 256
+_integrity_results = OrderedDict()
+_integrity_lock = threading.Lock()
+
+
+def check_database_integrity(db_path, digest):
+    """ PRAGMA quick_check で検査し、問題の一覧を返す（問題がなければ空のリスト） """
+    with _integrity_lock:
+        if digest in _integrity_results:
+            _integrity_results.move_to_end(digest)
+            return _integrity_results[digest]
+
+    try:
+        conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            rows = [row[0] for row in conn.execute("PRAGMA quick_check")]
+        finally:
+            conn.close()
+        problems = [] if rows == ["ok"] else rows
+    except sqlite3.DatabaseError as e:
+        # SQLite のファイルではない
+        problems = [str(e)]
+
+    with _integrity_lock:
+        _integrity_results[digest] = problems
+        _integrity_results.move_to_end(digest)
+        while len(_integrity_results) > INTEGRITY_CACHE_SIZE:
+            _integrity_results.popitem(last=False)
+    return problems
+
+
+def find_duplicate_lookup_keys(conn):
+    """
+    照合キーが重複しているマスタの行を返す（{テーブル名: DataFrame}。重複がなければ空の dict）。
+    照合では全角・半角や空白などの表記ゆれを吸収するため、表記ゆれだけが異なるキーも重複として扱う
+    """
+    duplicates = {}
+    for table, keys in LOOKUP_KEYS.items():
+        df = pd.read_sql_query(f"""
+            SELECT {", ".join(keys)} FROM {table}
+            WHERE {" AND ".join(f"{k} IS NOT NULL" for k in keys)}
+        """, conn)
+        lookup_keys = [pd.Series(normalize_lookup_keys(df[k]), index=df.index) for k in keys]
+        # 重複しているキーごとに、マスタに登録されている表記を「 / 」区切りで表示する
+        summary = df.groupby(lookup_keys, sort=False).agg(
+            **{k: (k, lambda names: " / ".join(pd.unique(names))) for k in keys}, 件数=(keys[0], "size")
+        )
+        summary = summary[summary["件数"] > 1].reset_index(drop=True)
+        if not summary.empty:
+            duplicates[table] = summary
+    return duplicates
+
+
+def bulk_upsert(conn, table, df, columns, key="管理番号"):
+    """
+    df を一時テーブルに一括投入し、1つのトランザクションで table に反映する。
+    キーが重複する行は後の行を優先する（従来の1行ずつの INSERT OR REPLACE と同じ）。
+    戻り値は {"inserted": 追加件数, "updated": 更新件数, "unchanged": 変更なし件数}
+    """
+    staging = f"staging_{table}"
+    column_list = ", ".join(columns)
+    placeholders = ", ".join("?" for _ in columns)
+    values = df[columns].astype(object).where(df[columns].notna(), None).to_numpy().tolist()
+
+    # 反映対象の行（キーごとに最後の行。キーが空の行はそれぞれ新規行として扱う）
+    latest_rows = f"""
+        SELECT rowid FROM temp.{staging} WHERE {key} IS NULL
+        UNION ALL
+        SELECT MAX(rowid) FROM temp.{staging} WHERE {key} IS NOT NULL GROUP BY {key}
+    """
+    differs = " OR ".join(f"s.{c} IS NOT t.{c}" for c in columns if c != key) or "0"
+    updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != key)
+
+    with conn:
+        conn.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+        conn.execute(f"CREATE TEMP TABLE {staging} AS SELECT {column_list} FROM {table} WHERE 0")
+        conn.executemany(f"INSERT INTO temp.{staging} ({column_list}) VALUES ({placeholders})", values)
+
+        inserted, updated, unchanged = conn.execute(f"""
+            SELECT
+                COALESCE(SUM(t.{key} IS NULL), 0),
+                COALESCE(SUM(t.{key} IS NOT NULL AND ({differs})), 0),
+                COALESCE(SUM(t.{key} IS NOT NULL AND NOT ({differs})), 0)
+            FROM temp.{staging} AS s
+            LEFT JOIN {table} AS t ON t.{key} = s.{key}
+            WHERE s.rowid IN ({latest_rows})
+        """).fetchone()
+
+        # 追加・変更のある行だけを書き込む
+        conn.execute(f"""
+            INSERT INTO {table} ({column_list})
+            SELECT {column_list} FROM temp.{staging}
+            WHERE rowid IN ({latest_rows})
+            ON CONFLICT({key}) DO UPDATE SET {updates}
+            WHERE {" OR ".join(f"{table}.{c} IS NOT excluded.{c}" for c in columns if c != key)}
+        """)
+        conn.execute(f"DROP TABLE temp.{staging}")
+
+    return {"inserted": inserted, "updated": updated, "unchanged": unchanged}
+
+
+def upsert_summary(counts):
+    return f"追加 {counts['inserted']} 件 / 更新 {counts['updated']} 件 / 変更なし {counts['unchanged']} 件"
+
+
+def _db_value(value):
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def apply_editor_changes(conn, table, original, editor_state, columns, key="管理番号"):
+    """
+    st.data_editor の編集状態（edited_rows / added_rows / deleted_rows）から、
+    変更・追加・削除された行だけを1つのトランザクションで反映する。
+    original は data_editor に渡した DataFrame（行位置が編集状態の行番号に対応する）。
+    戻り値は {"updated": 更新件数, "added": 追加件数, "deleted": 削除件数}
+    """
+    value_columns = [c for c in columns if c != key]
+    deleted_positions = set(editor_state.get("deleted_rows", []))
+
+    updates = []
+    for position, changes in editor_state.get("edited_rows", {}).items():
+        position = int(position)
+        if position in deleted_positions:
+            continue
+        row = original.iloc[position]
+        current = {c: _db_value(row[c]) for c in value_columns}
+        edited = {**current, **{c: _db_value(v) for c, v in changes.items() if c in current}}
+        if edited != current:
+            updates.append([edited[c] for c in value_columns] + [_db_value(row[key])])
+
+    inserts = []
+    for row in editor_state.get("added_rows", []):
+        values = {c: _db_value(row.get(c)) for c in columns}
+        if all(values[c] is None for c in value_columns):
+            continue
+        if values[key] is None or str(values[key]).strip() == "":
+            values[key] = str(uuid.uuid4())
+        inserts.append([values[c] for c in columns])
+
+    deletes = [[_db_value(original.iloc[int(position)][key])] for position in deleted_positions]
+
+    with conn:
+        if deletes:
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", deletes)
+        if updates:
+            assignments = ", ".join(f"{c} = ?" for c in value_columns)
+            conn.executemany(f"UPDATE {table} SET {assignments} WHERE {key} = ?", updates)
+        if inserts:
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})", inserts
+            )
+
+    return {"updated": len(updates), "added": len(inserts), "deleted": len(deletes)}
+
+
+def delete_rows(conn, table, keys, key="管理番号"):
+    """ 指定したキーの行をまとめて削除する """
+    with conn:
+        conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", [[_db_value(k)] for k in keys])
+
+
+def snapshot_database(db_path, compress=False):
+    """
+    データベースの整合性のとれた複製をバイト列で返す（VACUUM INTO。書き込み途中の状態は含まれない）。
+    compress=True の場合は複製を ZIP に圧縮して返す
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        snapshot_path = os.path.join(temp_dir, os.path.basename(db_path))
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("VACUUM INTO ?", (snapshot_path,))
+        finally:
+            conn.close()
+
+        if not compress:
+            with open(snapshot_path, "rb") as f:
+                return f.read()
+
+        zip_path = snapshot_path + ".zip"
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.write(snapshot_path, os.path.basename(db_path))
+        with open(zip_path, "rb") as f:
+            return f.read()
@@ -0,0 +1,48 @@
+import os
+from datetime import datetime
+
+import streamlit as st
+
+from database import snapshot_database
+from temp_storage import file_signature
+
+
+def database_download_button(db_path, label, key):
+    """
+    データベースの保存ボタンを表示する。
+    ファイルは「保存用ファイルを作成」を押したときだけ作成し、再実行のたびにDBを読み込まない
+    """
+    db_name, db_ext = os.path.splitext(os.path.basename(db_path))
+    today = datetime.today().strftime("%Y%m%d")
+    state_key = f"{key}_snapshot"
+
+    compress = st.checkbox("ZIP形式に圧縮する", key=f"{key}_compress")
+    if st.button("📦 保存用ファイルを作成", key=f"{key}_prepare"):
+        with st.spinner("保存用ファイルを作成しています..."):
+            st.session_state[state_key] = {
+                "db_path": db_path,
+                "signature": file_signature(db_path),
+                "compress": compress,
+                "data": snapshot_database(db_path, compress=compress),
+            }
+
+    snapshot = st.session_state.get(state_key)
+    if snapshot is None:
+        return
+    # 作成後にDBが変更・切り替えられた場合は作り直してもらう
+    if snapshot["db_path"] != db_path or snapshot["signature"] != file_signature(db_path):
+        del st.session_state[state_key]
+        st.info("データベースが変更されたため、保存用ファイルを作成し直してください。")
+        return
+
+    if snapshot["compress"]:
+        file_name, mime = f"{db_name}_{today}.zip", "application/zip"
+    else:
+        file_name, mime = f"{db_name}_{today}{db_ext}", "application/octet-stream"
+    st.download_button(
+        label=label,
+        data=snapshot["data"],
+        file_name=file_name,
+        mime=mime,
+        key=f"{key}_download"
+    )
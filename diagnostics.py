@@ -0,0 +1,67 @@
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+
+class StageTimer:
+    """ 変換の各段階の処理時間と行数を記録する """
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append((name, time.perf_counter() - start, rows))
+
+    def summary(self):
+        """ 段階ごとの合計（分割変換では同じ段階が複数回記録される）を、記録された順に返す """
+        df = pd.DataFrame(self.records, columns=["処理", "時間(秒)", "行数"])
+        if df.empty:
+            return df
+        summary = df.groupby("処理", sort=False).agg({"時間(秒)": "sum", "行数": "sum"})
+        summary["行数"] = summary["行数"].astype("Int64").where(summary["行数"] > 0)
+        summary["行/秒"] = (summary["行数"] / summary["時間(秒)"]).round()
+        summary["割合"] = (summary["時間(秒)"] / summary["時間(秒)"].sum()).map("{:.1%}".format)
+        return summary.reset_index()
+
+
+class _NullTimer:
+    # 診断を無効にしているときの記録先。何もしない
+    _context = nullcontext()
+
+    def stage(self, name, rows=None):
+        return self._context
+
+
+NULL_TIMER = _NullTimer()
+
+
+def profile_call(func, *args, **kwargs):
+    """
+    func を cProfile で計測しながら実行する。
+    戻り値は (func の戻り値, pstats のダンプ（バイト列）, 累積時間上位の一覧（文字列）)
+    """
+    profile = cProfile.Profile()
+    result = profile.runcall(func, *args, **kwargs)
+
+    stats = pstats.Stats(profile)
+    text = io.StringIO()
+    stats.stream = text
+    stats.sort_stats("cumulative").print_stats(30)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "henkan.prof")
+        stats.dump_stats(path)
+        with open(path, "rb") as f:
+            dump = f.read()
+    return result, dump, text.getvalue()
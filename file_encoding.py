@@ -0,0 +1,73 @@
+import codecs
+import re
+from functools import lru_cache
+
+import chardet
+
+# 判定に使う先頭部分の大きさ
+SAMPLE_SIZE = 64 * 1024
+
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# 厳密にデコードできるかを順に試す文字コード（弥生会計・Excelの出力はほぼこのどちらか）
+_FAST_PATH_ENCODINGS = ["utf-8", "cp932"]
+
+
+def detect_encoding_from_sample(sample):
+    """ ファイル先頭のバイト列から文字コードを判定する """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    for encoding in _FAST_PATH_ENCODINGS:
+        try:
+            # 先頭部分で切れた末尾の文字は不完全でもよい（final=False）
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+
+    encoding = (chardet.detect(sample)["encoding"] or "utf-8").lower()
+    # Shift_JIS と判定された場合は上位互換の cp932 で読む
+    if encoding in ("shift_jis", "shift-jis", "sjis"):
+        return "cp932"
+    return encoding
+
+
+_NON_ASCII = re.compile(rb"[\x80-\xff]")
+
+
+def _informative_sample(data):
+    # 先頭が英数字だけだと文字コードを判別できないため、最初の非ASCII文字から切り出す
+    match = _NON_ASCII.search(data)
+    start = match.start() if match else 0
+    return bytes(data[start:start + SAMPLE_SIZE])
+
+
+# 判定結果は先頭部分（判定に使うバイト列）だけで決まるため、それをキーにキャッシュする
+_detect_cached = lru_cache(maxsize=256)(detect_encoding_from_sample)
+
+
+def detect_encoding(raw_data):
+    """ アップロードされたファイルの文字コードを判定する。先頭部分が同じファイルの判定結果はキャッシュする """
+    return _detect_cached(_informative_sample(raw_data))
+
+
+def detect_stream_encoding(f):
+    """ ファイルオブジェクトの文字コードを、全体を読み込まずに判定する（呼び出し後の位置は不定） """
+    block = f.read(SAMPLE_SIZE)
+    while block and not _NON_ASCII.search(block):
+        next_block = f.read(SAMPLE_SIZE)
+        if not next_block:
+            break
+        block = next_block
+    match = _NON_ASCII.search(block)
+    if match:
+        block = block[match.start():]
+        if len(block) < SAMPLE_SIZE:
+            block += f.read(SAMPLE_SIZE - len(block))
+    return detect_encoding_from_sample(block[:SAMPLE_SIZE])
@@ -0,0 +1,159 @@
+"""
+弥生会計の仕訳データを財務R4インポート形式のCSVへ一括変換するコマンド
+
+    python henkan_batch.py --db my_database.db --output-dir out 仕訳_01.csv 仕訳_02.xlsx exports/
+
+ディレクトリを指定した場合は直下の .csv / .xlsx をすべて変換します。
+変換はCPUコア数分のプロセスで並列に実行し、マスタは各プロセスで1回だけ読み込みます。
+--chunksize を指定すると、CSVを指定行数ずつ読み込んで変換・追記します（複数年分など大容量のファイル向け）。
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from henkan_core import (
+    read_yayoi_file, normalize_journal, load_masters, convert_journal, write_r4_csv, convert_csv_in_chunks,
+    find_unmapped_rows
+)
+
+INPUT_SUFFIXES = (".csv", ".xlsx")
+
+# ワーカープロセスの起動方法。Streamlit のサーバーなどスレッドのあるプロセスから fork すると、
+# 他のスレッドが持っていたロックを引き継いで子プロセスが止まることがあるため spawn を使う
+# （マスタは init_worker で各プロセスが読み込み直すため、親の状態は引き継がなくてよい）
+WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+# ワーカープロセスごとに読み込んだマスタ
+_masters = None
+
+
+def init_worker(db_path):
+    """ ワーカープロセスの初期化。マスタを読み取り専用で1回だけ読み込む """
+    global _masters
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        _masters = load_masters(conn)
+    finally:
+        conn.close()
+
+
+def _convert_file(input_path, output_path, chunksize=None):
+    # CSVは分割変換にすると、ファイルの大きさに関係なくメモリ使用量が chunksize 行分に収まる
+    if chunksize and input_path.suffix.lower() == ".csv":
+        return convert_csv_in_chunks(input_path, _masters, output_path, chunksize=chunksize)
+    df = read_yayoi_file(input_path, input_path.name)
+    normalize_journal(df, _masters["rules"])
+    df_book = convert_journal(df, _masters)
+    write_r4_csv(df_book, output_path)
+    return len(df_book)
+
+
+def convert_uploaded_bytes(file_name, data):
+    """
+    アップロードされたファイルの内容を変換する（init_worker で初期化したワーカープロセスで実行）。
+    戻り値は (財務R4形式のCSV（バイト列）, {"rows": 件数, "unmapped": マスタ未登録の行数, "unparsed_dates": 日付変換不可の行数})
+    """
+    df = read_yayoi_file(io.BytesIO(data), file_name)
+    normalize_journal(df, _masters["rules"])
+    df_book = convert_journal(df, _masters)
+    output = io.BytesIO()
+    write_r4_csv(df_book, output)
+    return output.getvalue(), {
+        "rows": len(df_book),
+        "unmapped": int(find_unmapped_rows(df, df_book).sum()),
+        "unparsed_dates": len(df.attrs.get("unparsed_dates", [])),
+    }
+
+
+def collect_input_files(paths):
+    # 同じファイルを重ねて指定した場合（ファイルとそのディレクトリなど）は1回だけ変換する
+    files = {}
+    for path in map(Path, paths):
+        if path.is_dir():
+            for p in sorted(p for p in path.iterdir() if p.suffix.lower() in INPUT_SUFFIXES):
+                files.setdefault(p.resolve(), p)
+        else:
+            files.setdefault(path.resolve(), path)
+    return list(files.values())
+
+
+def output_file_name(name, used):
+    """
+    変換後のCSVのファイル名（元のファイル名_R4.csv）を返し、used に加える。
+    used にある名前と重なる場合は連番を付ける（大文字・小文字だけが違う名前も重なるものとして扱う）
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    entry, n = f"{stem}_R4.csv", 1
+    while entry.lower() in used:
+        n += 1
+        entry = f"{stem}_{n}_R4.csv"
+    used.add(entry.lower())
+    return entry
+
+
+def plan_output_paths(files, output_dir):
+    """
+    入力ファイルごとの出力先を決める。別のディレクトリの同名のファイルや a.csv と a.xlsx は連番で区別し、
+    出力先の入力ファイルは上書きしない。それでも出力先が重なる場合は ValueError
+    """
+    output_dir = Path(output_dir)
+    inputs = {path.resolve() for path in files}
+    used = {path.name.lower() for path in files if path.resolve().parent == output_dir.resolve()}
+    outputs = [output_dir / output_file_name(path.name, used) for path in files]
+    resolved = [path.resolve() for path in outputs]
+    if len(set(resolved)) != len(resolved) or inputs & set(resolved):
+        raise ValueError("出力先のファイル名を一意に決められません。入力ファイルを分けて実行してください。")
+    return outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="弥生会計の仕訳データを財務R4インポート形式に一括変換します。")
+    parser.add_argument("inputs", nargs="+", help="弥生会計から出力したCSV/XLSXファイル、またはそれを含むディレクトリ")
+    parser.add_argument("--db", required=True, help="マスタを登録したSQLiteデータベース")
+    parser.add_argument("--output-dir", default=".", help="変換後のCSVの出力先（既定: カレントディレクトリ）")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="指定した行数ずつ分割して変換する（CSVのみ。大容量ファイル向け）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="並列プロセス数（既定: CPUコア数）")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db):
+        parser.error(f"データベースが見つかりません: {args.db}")
+    files = collect_input_files(args.inputs)
+    if not files:
+        parser.error("変換対象のファイルがありません。")
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        output_paths = plan_output_paths(files, output_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    failed = 0
+    workers = max(1, min(args.workers or 1, len(files)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT,
+                             initializer=init_worker, initargs=(args.db,)) as executor:
+        futures = {}
+        for path, output_path in zip(files, output_paths):
+            futures[executor.submit(_convert_file, path, output_path, args.chunksize)] = (path, output_path)
+        for future in as_completed(futures):
+            path, output_path = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"NG  {path}: {e}", file=sys.stderr)
+            else:
+                print(f"OK  {path} -> {output_path} ({rows}件)")
+
+    print(f"完了: {len(files) - failed}件成功 / {failed}件失敗")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,438 @@
+import io
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from diagnostics import NULL_TIMER
+from file_encoding import detect_encoding, detect_stream_encoding
+from lookup_keys import normalize_lookup_keys
+from henkan_rules import STAGE_JOURNAL, STAGE_SUB_ACCOUNT, apply_rules, compile_rules, default_rules_frame, read_rules
+from xlsx_reader import read_xlsx
+
+# 弥生会計インポート形式の列（25列）
+YAYOI_COLUMNS = [
+    "識別フラグ", "伝票No.", "決算", "取引日付", "借方勘定科目", "借方補助科目", "借方部門", "借方税区分",
+    "借方金額", "借方税金額", "貸方勘定科目", "貸方補助科目", "貸方部門", "貸方税区分", "貸方金額", "貸方税金額",
+    "摘要", "番号", "期日", "タイプ", "生成元", "仕訳メモ", "付箋1", "付箋2", "調整"
+]
+
+# 財務R4インポート形式の列（45列）
+R4_COLUMNS = [
+    "月種別", "種類", "形式", "作成方法", "付箋", "伝票日付", "伝票番号", "伝票摘要", "枝番",
+    "借方部門", "借方部門名", "借方科目", "借方科目名", "借方補助", "借方補助科目名", "借方金額",
+    "借方消費税コード", "借方消費税業種", "借方消費税税率", "借方資金区分", "借方任意項目１",
+    "借方任意項目２", "借方インボイス情報", "貸方部門", "貸方部門名", "貸方科目", "貸方科目名",
+    "貸方補助", "貸方補助科目名", "貸方金額", "貸方消費税コード", "貸方消費税業種",
+    "貸方消費税税率", "貸方資金区分", "貸方任意項目１", "貸方任意項目２", "貸方インボイス情報",
+    "摘要", "期日", "証番号", "入力マシン", "入力ユーザ", "入力アプリ", "入力会社", "入力日付"
+]
+
+# 読み込み時に変更する弥生会計の列名
+YAYOI_RENAMES = {"取引日付": "日付", "借方税金額": "借方税額", "貸方税金額": "貸方税額"}
+JOURNAL_COLUMNS = [YAYOI_RENAMES.get(c, c) for c in YAYOI_COLUMNS]
+
+# 変換ルールで使える列（段階ごとに (条件に使える列, 設定できる列)）。
+# 補助科目の段階では、補助科目がマスタと一致したかどうか（"一致" / "不一致"）を「借方補助照合」「貸方補助照合」で参照できる
+SUB_ACCOUNT_MATCH_COLUMNS = {"借方": "借方補助照合", "貸方": "貸方補助照合"}
+RULE_TARGET_COLUMNS = {
+    STAGE_JOURNAL: (set(JOURNAL_COLUMNS), set(JOURNAL_COLUMNS)),
+    STAGE_SUB_ACCOUNT: (set(R4_COLUMNS) | set(SUB_ACCOUNT_MATCH_COLUMNS.values()), set(R4_COLUMNS)),
+}
+
+# 和暦の元号記号と、和暦年に加えると西暦年になる年数
+ERA_OFFSETS = {"R": 2018, "H": 1988, "S": 1925}
+
+# 「R.06/04/01」のような和暦、「2024/04/01」のような西暦、または区切りのない「20240401」（時刻部分は無視）
+_DATE_PATTERN = (
+    r"^\s*(?:(?:(?P<era>[RHS])\.)?(?P<year>\d{1,4})[/.-](?P<month>\d{1,2})[/.-](?P<day>\d{1,2})"
+    r"|(?P<year8>\d{4})(?P<month8>\d{2})(?P<day8>\d{2}))(?:[ T].*)?\s*$"
+)
+
+
+def _parse_date_strings(text):
+    # 元号記号・年・月・日に分解し、元号ごとの加算年数で西暦に直す
+    parts = text.str.extract(_DATE_PATTERN)
+    for name in ("year", "month", "day"):
+        parts[name] = parts[name].fillna(parts[f"{name}8"])
+    year = pd.to_numeric(parts["year"])
+    # 元号なしの場合は4桁の西暦のみを受け付ける
+    year = year.where(parts["era"].notna() | (parts["year"].str.len() == 4))
+    year = year + parts["era"].map(ERA_OFFSETS).fillna(0)
+    return pd.to_datetime(
+        pd.DataFrame({"year": year, "month": pd.to_numeric(parts["month"]), "day": pd.to_numeric(parts["day"])}),
+        errors="coerce",
+    )
+
+
+def parse_journal_dates(values):
+    """ 日付列を列全体で一括変換する。変換後の日付（datetime.date）と、変換できなかった行のマスクを返す """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.date, pd.Series(False, index=values.index)
+
+    # 仕訳の日付は種類が少ないため、重複を除いた値だけを解析して全行に展開する（欠損値は code = -1）
+    codes, uniques = pd.factorize(values.astype(object))
+    text = pd.Series(uniques, dtype=object).astype(str)
+    parsed = _parse_date_strings(text)
+    unique_dates = np.append(parsed.dt.date.to_numpy(dtype=object), pd.NaT)
+    unique_unparsed = np.append((parsed.isna() & (text.str.strip() != "")).to_numpy(), False)
+    dates = pd.Series(unique_dates[codes], index=values.index, dtype=object)
+    unparsed = pd.Series(unique_unparsed[codes], index=values.index)
+    return dates, unparsed
+
+
+# 文字列として読み込む列（ファイル全体と分割読み込みで型推論が変わらないようにする）
+TEXT_COLUMNS = [
+    "取引日付", "借方勘定科目", "借方補助科目", "借方部門", "借方税区分",
+    "貸方勘定科目", "貸方補助科目", "貸方部門", "貸方税区分", "摘要"
+]
+TEXT_DTYPES = {YAYOI_COLUMNS.index(c): str for c in TEXT_COLUMNS}
+
+# 財務R4形式へそのまま出力される数値列
+NUMERIC_COLUMNS = ["伝票No.", "借方金額", "貸方金額"]
+
+# 分割変換の既定の行数
+DEFAULT_CHUNKSIZE = 50_000
+# 1ファイルを変換するときの進捗の報告単位
+DEFAULT_BATCH_ROWS = 20_000
+
+
+@contextmanager
+def _open_binary(source):
+    if hasattr(source, "read"):
+        source.seek(0)
+        yield source
+    else:
+        with open(source, "rb") as f:
+            yield f
+
+
+def prepare_yayoi_frame(df):
+    """ 読み込んだ弥生会計の仕訳に列名を付け、日付を変換する """
+    df.columns = YAYOI_COLUMNS
+    df.rename(columns=YAYOI_RENAMES, inplace=True)
+
+    df["日付"], unparsed = parse_journal_dates(df["日付"])
+    # 日付を変換できなかった行（行番号）。空欄の日付は含まない
+    df.attrs["unparsed_dates"] = df.index[unparsed.to_numpy()].tolist()
+
+    return df
+
+
+def read_yayoi_file(source, file_name, timer=NULL_TIMER):
+    """ 弥生会計から出力した仕訳データ（CSV / XLSX）を読み込む。source はパスまたはファイルオブジェクト """
+    file_name = file_name.lower()
+    with timer.stage("ファイル読み込み"):
+        if file_name.endswith(".csv"):
+            with _open_binary(source) as f:
+                raw_data = f.read()
+            df = pd.read_csv(io.BytesIO(raw_data), header=None, dtype=TEXT_DTYPES,
+                             encoding=detect_encoding(raw_data), encoding_errors="replace")
+        elif file_name.endswith(".xlsx"):
+            df = read_xlsx(source)
+        else:
+            raise ValueError("対応ファイル形式は .csv / .xlsx です。")
+
+    with timer.stage("日付変換", len(df)):
+        return prepare_yayoi_frame(df)
+
+
+def _merge_dtype(current, new):
+    if current is None:
+        return new
+    if current == object or new == object:
+        return object
+    return np.result_type(current, new)
+
+
+def _scan_yayoi_csv(source, chunksize):
+    # 分割読み込みの前に文字コードを判定し、数値列だけを走査して型をファイル全体で確定させる
+    with _open_binary(source) as f:
+        encoding = detect_stream_encoding(f)
+    numeric_positions = [YAYOI_COLUMNS.index(c) for c in NUMERIC_COLUMNS]
+    dtypes = {}
+    with _open_binary(source) as f:
+        for chunk in pd.read_csv(f, header=None, usecols=numeric_positions, chunksize=chunksize,
+                                 encoding=encoding, encoding_errors="replace"):
+            for position in numeric_positions:
+                dtypes[position] = _merge_dtype(dtypes.get(position), chunk[position].dtype)
+    return encoding, dtypes
+
+
+def iter_yayoi_csv_chunks(source, chunksize=DEFAULT_CHUNKSIZE, timer=NULL_TIMER):
+    """ 弥生会計のCSVを chunksize 行ずつ読み込み、read_yayoi_file と同じ形に整えて返す """
+    with timer.stage("文字コード判定・型の走査"):
+        encoding, numeric_dtypes = _scan_yayoi_csv(source, chunksize)
+    with _open_binary(source) as f:
+        reader = pd.read_csv(f, header=None, dtype={**TEXT_DTYPES, **numeric_dtypes}, chunksize=chunksize,
+                             encoding=encoding, encoding_errors="replace")
+        while True:
+            with timer.stage("ファイル読み込み"):
+                chunk = next(reader, None)
+            if chunk is None:
+                break
+            with timer.stage("日付変換", len(chunk)):
+                df = prepare_yayoi_frame(chunk)
+            yield df
+
+
+def normalize_journal(df, rules=None):
+    """
+    変換ルールの「仕訳」の段階を適用する（既定のルールでは諸口の補完と賃貸収入の科目振替）。
+    rules は load_masters で読み込んだ masters["rules"]。省略した場合は既定のルール
+    """
+    rules = default_conversion_rules() if rules is None else rules
+    return apply_rules(df, rules[STAGE_JOURNAL])
+
+
+def compile_conversion_rules(rules):
+    """ 変換ルールの表（henkan_rules の行）を適用できる形に展開する。不正なルールがあれば ValueError """
+    return compile_rules(rules, RULE_TARGET_COLUMNS)
+
+
+@lru_cache(maxsize=1)
+def default_conversion_rules():
+    return compile_conversion_rules(default_rules_frame())
+
+
+def load_masters(conn):
+    """ 変換に使う3つのマスタ（勘定科目・消費税・補助科目）を読み込み、照合用に索引化する """
+    kamoku = pd.read_sql(
+        "SELECT 財務R4科目コード, 財務R4科目名, 弥生会計科目名 FROM kamoku_master", conn
+    )
+    syouhizei = pd.read_sql("""
+        SELECT 財務R4税コード, 財務R4税率, 財務R4インボイス, 財務R4簡易課税, 弥生会計税区分
+        FROM syouhizei_master
+    """, conn)
+    hojo = pd.read_sql_query("""
+        SELECT 管理番号, 財務R4科目コード, 財務R4科目名, 財務R4補助科目コード,
+               財務R4補助科目名, 弥生会計補助科目名
+        FROM hojo_master
+    """, conn)
+    return compile_masters(kamoku, syouhizei, hojo, read_rules(conn))
+
+
+def build_lookup_index(master, key_columns):
+    # マスタをキー列で索引化する。キーは表記ゆれを吸収した値（normalize_lookup_keys）で、
+    # 照合する側も同じ変換をしたキーで参照する（キーが重複する場合は先頭行を優先、キーが欠損している行は除外）
+    master = master.assign(**{c: normalize_lookup_keys(master[c]) for c in key_columns})
+    return (
+        master.dropna(subset=key_columns)
+        .drop_duplicates(subset=key_columns, keep="first")
+        .set_index(key_columns)
+    )
+
+
+def compile_masters(kamoku, syouhizei, hojo, rules):
+    # 照合キーごとに索引化したマスタと展開済みの変換ルール。変換のたびに作り直さずに使い回す
+    return {
+        "kamoku": build_lookup_index(kamoku, ["弥生会計科目名"]),
+        "syouhizei": build_lookup_index(syouhizei, ["弥生会計税区分"]),
+        "hojo": build_lookup_index(hojo, ["財務R4科目名", "弥生会計補助科目名"]),
+        "rules": compile_conversion_rules(rules),
+    }
+
+
+def map_accounts(df, df_book, kamoku_index):
+    # 借方・貸方それぞれ1回のハッシュ参照で科目を割り当てる
+    for col in ["借方", "貸方"]:
+        matched = kamoku_index.reindex(normalize_lookup_keys(df[f"{col}勘定科目"]))
+        df_book[f"{col}科目"] = matched["財務R4科目コード"].to_numpy()
+        df_book[f"{col}科目名"] = matched["財務R4科目名"].to_numpy()
+    df_book["借方金額"] = df["借方金額"]
+    df_book["貸方金額"] = df["貸方金額"]
+    return df_book
+
+
+def map_taxes(df, df_book, tax_index):
+    # 借方・貸方の税区分から4項目をまとめて割り当てる
+    tax_columns = {
+        "消費税コード": "財務R4税コード",
+        "消費税税率": "財務R4税率",
+        "インボイス情報": "財務R4インボイス",
+        "消費税業種": "財務R4簡易課税",
+    }
+    for col in ["借方", "貸方"]:
+        matched = tax_index.reindex(normalize_lookup_keys(df[f"{col}税区分"]))
+        for book_column, master_column in tax_columns.items():
+            df_book[f"{col}{book_column}"] = matched[master_column].to_numpy()
+    return df_book
+
+
+def update_df_book(df, df_book, hojo_index, rules=None):
+    """
+    補助科目をマスタと照合して割り当て、変換ルールの「補助科目」の段階を適用する
+    （既定のルールでは、マスタにない補助科目の補助 0・その他 の補完など）
+    """
+    # hojo_index: (財務R4科目名, 弥生会計補助科目名) → (財務R4補助科目コード, 財務R4補助科目名)
+    hojo_codes = hojo_index["財務R4補助科目コード"].to_numpy(dtype=object)
+    hojo_names = hojo_index["財務R4補助科目名"].to_numpy(dtype=object)
+    rules = default_conversion_rules() if rules is None else rules
+
+    # 借方科目には貸方補助科目を、貸方科目には借方補助科目を照合する
+    sub_account_side = {"借方": "貸方", "貸方": "借方"}
+    match_columns = {}
+    for col, sub_col in sub_account_side.items():
+        keys = pd.MultiIndex.from_arrays([
+            normalize_lookup_keys(df_book[f"{col}科目名"]),
+            normalize_lookup_keys(df[f"{sub_col}補助科目"]),
+        ])
+        position = hojo_index.index.get_indexer(keys)
+        matched = position >= 0
+
+        # マッチしない行の補助はルールで設定する
+        sub_code = np.full(len(df_book), np.nan, dtype=object)
+        sub_name = np.full(len(df_book), np.nan, dtype=object)
+        sub_code[matched] = hojo_codes[position[matched]]
+        sub_name[matched] = hojo_names[position[matched]]
+        df_book[f"{col}補助"] = sub_code
+        df_book[f"{col}補助科目名"] = sub_name
+        match_columns[SUB_ACCOUNT_MATCH_COLUMNS[col]] = pd.Series(
+            np.where(matched, "一致", "不一致"), index=df_book.index, dtype=object
+        )
+
+    return apply_rules(df_book, rules[STAGE_SUB_ACCOUNT], match_columns)
+
+
+def new_df_book(df):
+    """ 財務R4形式の空の仕訳に、日付・摘要・伝票番号を転記する """
+    df_book = pd.DataFrame(columns=R4_COLUMNS)
+
+    df_book["伝票日付"] = df["日付"]
+    df_book["摘要"] = df["摘要"]
+    df_book["伝票番号"] = df["伝票No."]
+    return df_book
+
+
+def convert_journal(df, masters, timer=NULL_TIMER):
+    """ 整形済みの弥生会計仕訳（normalize_journal 適用後）を財務R4形式に変換する """
+    with timer.stage("勘定科目の割り当て", len(df)):
+        df_book = new_df_book(df)
+        map_accounts(df, df_book, masters["kamoku"])
+    with timer.stage("消費税区分の割り当て", len(df)):
+        map_taxes(df, df_book, masters["syouhizei"])
+    with timer.stage("補助科目の割り当て", len(df)):
+        update_df_book(df, df_book, masters["hojo"], masters["rules"])
+    return df_book
+
+
+def find_unmapped_rows(df, df_book):
+    """ 勘定科目・税区分がマスタに登録されていない行を True とする配列を返す """
+    unmapped = np.zeros(len(df_book), dtype=bool)
+    for col in ["借方", "貸方"]:
+        unmapped |= (df_book[f"{col}科目"].isna() & df[f"{col}勘定科目"].notna()).to_numpy()
+        unmapped |= (df_book[f"{col}消費税コード"].isna() & df[f"{col}税区分"].notna()).to_numpy()
+    return unmapped
+
+
+def _unmapped_summary(keys, amounts, mask, kind, side):
+    # mask の行をキーごとに集計し、(区分, 借貸, キー, 件数, 金額合計) の表にする
+    grouped = pd.DataFrame({**keys, "金額": amounts})[mask].groupby(list(keys), sort=False, dropna=False)
+    summary = grouped["金額"].agg(件数="size", 金額合計="sum").reset_index()
+    summary.insert(0, "借貸", side)
+    summary.insert(0, "区分", kind)
+    return summary
+
+
+def find_unmapped_keys(df, masters):
+    """
+    変換の前に、マスタに登録されていない勘定科目・税区分・補助科目を一覧にする（読み込んだ仕訳をそのまま渡す）。
+    マスタの索引と一括で照合し、未登録のキーごとの件数と金額合計を返す。
+    補助科目が見つからない仕訳は変換ルールで補助を設定する（既定では "0"・その他）ため、区分を分けて返す
+    """
+    # 変換ルールの「仕訳」の段階（諸口の補完・賃貸収入の振替など）を適用した後の値で照合する（df は変更しない）
+    journal = normalize_journal(df.copy(), masters["rules"])
+    kamoku, syouhizei, hojo = masters["kamoku"], masters["syouhizei"], masters["hojo"]
+
+    summaries = []
+    for side, sub_side in [("借方", "貸方"), ("貸方", "借方")]:
+        # 照合は表記ゆれを吸収したキーで行い、一覧には仕訳の元の名称を表示する
+        account = journal[f"{side}勘定科目"]
+        account_key = normalize_lookup_keys(account)
+        tax = journal[f"{side}税区分"]
+        amount = pd.to_numeric(journal[f"{side}金額"], errors="coerce")
+        summaries.append(_unmapped_summary(
+            {"弥生会計の名称": account}, amount, account.notna().to_numpy() & (kamoku.index.get_indexer(account_key) < 0),
+            "勘定科目", side
+        ))
+        summaries.append(_unmapped_summary(
+            {"弥生会計の名称": tax}, amount,
+            tax.notna().to_numpy() & (syouhizei.index.get_indexer(normalize_lookup_keys(tax)) < 0), "税区分", side
+        ))
+
+        # 補助科目は update_df_book と同じく、この側の科目（財務R4科目名）と反対側の補助科目で照合する
+        sub_account = journal[f"{sub_side}補助科目"]
+        sub_key = normalize_lookup_keys(sub_account)
+        has_sub = pd.notna(sub_key) & (sub_key != "")
+        r4_account = pd.Series(kamoku["財務R4科目名"].reindex(account_key).to_numpy(), index=journal.index)
+        pairs = pd.MultiIndex.from_arrays([normalize_lookup_keys(r4_account), sub_key])
+        # 科目が未登録の行は勘定科目として報告済み
+        unmatched = has_sub & r4_account.notna().to_numpy() & (hojo.index.get_indexer(pairs) < 0)
+        summaries.append(_unmapped_summary(
+            {"弥生会計の名称": sub_account, "財務R4科目名": r4_account}, amount, unmatched, "補助科目", side
+        ))
+
+    # 勘定科目・税区分・補助科目の順に、件数の多いキーから並べる
+    kind_order = {"勘定科目": 0, "税区分": 1, "補助科目": 2}
+    columns = ["区分", "借貸", "弥生会計の名称", "財務R4科目名", "件数", "金額合計"]
+    return pd.concat(summaries, ignore_index=True).reindex(columns=columns).sort_values(
+        ["区分", "件数"], ascending=[True, False], kind="stable", ignore_index=True,
+        key=lambda column: column.map(kind_order) if column.name == "区分" else column
+    )
+
+
+def write_r4_csv(df_book, path_or_buf):
+    # Excel文字化け回避のためutf-8-sig
+    df_book.to_csv(path_or_buf, index=False, encoding="utf-8-sig")
+
+
+def convert_csv_in_chunks(source, masters, path_or_buf, chunksize=DEFAULT_CHUNKSIZE, timer=NULL_TIMER, progress=None):
+    """
+    CSVを分割して変換し、財務R4形式のCSVへ順次追記する。メモリ使用量は chunksize 行分に収まる。
+    progress を指定すると、チャンクごとに progress(変換済みの行数) を呼ぶ
+    """
+    rows = 0
+    with ExitStack() as stack:
+        if hasattr(path_or_buf, "write"):
+            output = path_or_buf
+        else:
+            output = stack.enter_context(open(path_or_buf, "wb"))
+        for i, df in enumerate(iter_yayoi_csv_chunks(source, chunksize, timer)):
+            with timer.stage("諸口・賃貸収入の補正", len(df)):
+                normalize_journal(df, masters["rules"])
+            df_book = convert_journal(df, masters, timer)
+            with timer.stage("CSV出力", len(df_book)):
+                # 先頭チャンクのみヘッダーとBOMを書き出す
+                if i == 0:
+                    write_r4_csv(df_book, output)
+                else:
+                    df_book.to_csv(output, index=False, header=False, encoding="utf-8")
+            rows += len(df_book)
+            if progress is not None:
+                progress(rows)
+    return rows
+
+
+def convert_journal_in_batches(df, masters, path_or_buf, batch_rows=DEFAULT_BATCH_ROWS, timer=NULL_TIMER, progress=None):
+    """
+    補正済みの仕訳を batch_rows 行ずつ変換して財務R4形式のCSVへ順次書き出し、変換結果をまとめて返す。
+    結果は convert_journal と write_r4_csv で一度に変換した場合と同じ。
+    progress を指定すると、区切りごとに progress(変換済みの行数) を呼ぶ（進捗の表示と取り消し用）
+    """
+    books = []
+    rows = 0
+    for start in range(0, max(len(df), 1), batch_rows):
+        df_book = convert_journal(df.iloc[start:start + batch_rows], masters, timer)
+        with timer.stage("CSV出力", len(df_book)):
+            # 先頭の区切りのみヘッダーとBOMを書き出す
+            if start == 0:
+                write_r4_csv(df_book, path_or_buf)
+            else:
+                df_book.to_csv(path_or_buf, index=False, header=False, encoding="utf-8")
+        books.append(df_book)
+        rows += len(df_book)
+        if progress is not None:
+            progress(rows)
+    return books[0] if len(books) == 1 else pd.concat(books)
@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+
+# ジョブの状態
+RUNNING = "実行中"
+DONE = "完了"
+CANCELLED = "取消"
+FAILED = "失敗"
+
+
+class JobCancelled(Exception):
+    """ 取り消されたジョブで進捗を報告したときに送出される """
+
+
+class ConversionJob:
+    """
+    変換をバックグラウンドのスレッドで実行し、進捗・結果・エラーを保持する（セッションごとに st.session_state に置く）。
+    func(job) は job.report で進捗を報告する。取り消し後の report は JobCancelled を送出して変換を途中で終える。
+    func の中では st.* を呼ばない（画面の更新はページ側で job の状態を見て行う）
+    """
+
+    def __init__(self, func, key=None, label="", unit="行", temp_paths=()):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.label = label
+        self.unit = unit
+        # 変換の入出力に使う一時ファイル（ジョブを破棄するときに削除する）
+        self.temp_paths = list(temp_paths)
+        self.status = RUNNING
+        self.done = 0
+        self.total = None
+        self.stage = ""
+        self.result = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(func,), name=f"henkan-job-{self.id[:8]}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self, func):
+        try:
+            result = func(self)
+        except JobCancelled:
+            status = CANCELLED
+        except Exception as e:
+            self.error, status = e, FAILED
+        else:
+            self.result, status = result, DONE
+        # 状態は最後に切り替える（ページ側は状態を見てから結果を読む）
+        self.finished_at = time.time()
+        self.status = status
+
+    def report(self, done, total=None, stage=None):
+        """ 進捗を記録する（変換のスレッドから呼ぶ）。取り消されていれば JobCancelled を送出する """
+        if self._cancelled.is_set():
+            raise JobCancelled()
+        if total is not None:
+            self.total = total
+        if stage is not None:
+            self.stage = stage
+        self.done = done
+
+    def cancel(self):
+        """ 取り消しを要求する（次の進捗の報告で変換が止まる） """
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        """ 変換の終了を待つ。終了していれば True """
+        self._thread.join(timeout)
+        return not self.running
+
+    @property
+    def running(self):
+        return self.status == RUNNING
+
+    @property
+    def cancelling(self):
+        return self.running and self._cancelled.is_set()
+
+    def fraction(self):
+        """ 進捗の割合（0〜1）。総数が分からない間は 0 """
+        if not self.total:
+            return 0.0
+        return min(self.done / self.total, 1.0)
+
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def progress_text(self):
+        total = f" / {self.total:,}" if self.total else ""
+        stage = f"{self.stage}: " if self.stage else ""
+        return f"{self.label} — {stage}{self.done:,}{total} {self.unit}（{self.elapsed():.0f}秒）"
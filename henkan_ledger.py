@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 変換履歴の照合に使う列。仕訳行は (伝票No., 伝票内の行番号) で特定し、これらの列の内容で変更を判定する
+FINGERPRINT_TEXT_COLUMNS = [
+    "借方勘定科目", "借方補助科目", "借方部門", "借方税区分",
+    "貸方勘定科目", "貸方補助科目", "貸方部門", "貸方税区分", "摘要"
+]
+FINGERPRINT_AMOUNT_COLUMNS = ["借方金額", "借方税額", "貸方金額", "貸方税額"]
+
+# 仕訳の状態（伝票単位で判定する）
+NEW = "新規"
+CHANGED = "変更"
+CONVERTED = "変換済"
+
+
+def journal_fingerprints(df):
+    """
+    仕訳行ごとの (伝票番号, 行番号, 指紋) を返す。指紋は列単位の一括ハッシュ（64ビット整数）。
+    CSV と XLSX、空欄の有無で列の型が変わっても同じ内容なら同じ指紋になるよう、型をそろえてから計算する
+    """
+    # 伝票No. が空欄の行は伝票番号 0 として扱う
+    slip = pd.to_numeric(df["伝票No."], errors="coerce").fillna(0).astype("int64").to_numpy()
+    canonical = pd.DataFrame({"日付": pd.to_datetime(df["日付"], errors="coerce").to_numpy()})
+    for column in FINGERPRINT_TEXT_COLUMNS:
+        canonical[column] = df[column].fillna("").astype(str).to_numpy()
+    for column in FINGERPRINT_AMOUNT_COLUMNS:
+        canonical[column] = pd.to_numeric(df[column], errors="coerce").astype("float64").to_numpy()
+
+    fingerprint = pd.util.hash_pandas_object(canonical, index=False).to_numpy().view(np.int64)
+    return pd.DataFrame({
+        "伝票番号": slip,
+        "行番号": pd.Series(slip).groupby(slip, sort=False).cumcount().to_numpy(),
+        "指紋": fingerprint,
+    })
+
+
+def classify_entries(conn, fingerprints):
+    """
+    変換履歴と照合し、仕訳行ごとの状態（NEW / CHANGED / CONVERTED）の配列を返す。
+    伝票の一部の行だけを出力しないよう、伝票内のいずれかの行が変わっていれば伝票全体を CHANGED とする
+    """
+    if fingerprints.empty:
+        return np.array([], dtype=object)
+    slip = fingerprints["伝票番号"]
+    ledger = pd.read_sql_query(
+        "SELECT 伝票番号, 行番号, 指紋 FROM henkan_ledger WHERE 伝票番号 BETWEEN ? AND ?",
+        conn, params=(int(slip.min()), int(slip.max()))
+    )
+
+    position = pd.MultiIndex.from_frame(ledger[["伝票番号", "行番号"]]).get_indexer(
+        pd.MultiIndex.from_frame(fingerprints[["伝票番号", "行番号"]])
+    )
+    same = position >= 0
+    same[same] = ledger["指紋"].to_numpy()[position[same]] == fingerprints["指紋"].to_numpy()[same]
+
+    known = slip.isin(ledger["伝票番号"]).to_numpy()
+    all_same = pd.Series(same).groupby(slip.to_numpy()).transform("all").to_numpy()
+    same_count = (slip.groupby(slip).transform("size")
+                  == slip.map(ledger.groupby("伝票番号").size()).fillna(0)).to_numpy()
+    return np.where(~known, NEW, np.where(all_same & same_count, CONVERTED, CHANGED)).astype(object)
+
+
+def record_entries(conn, fingerprints):
+    """ 仕訳行を変換履歴に登録する（登録済みの伝票は行ごと置き換える） """
+    converted_at = datetime.now().isoformat(timespec="seconds")
+    slips = [[s] for s in fingerprints["伝票番号"].unique().tolist()]
+    rows = [row + [converted_at] for row in fingerprints[["伝票番号", "行番号", "指紋"]].to_numpy().tolist()]
+    with conn:
+        conn.executemany("DELETE FROM henkan_ledger WHERE 伝票番号 = ?", slips)
+        conn.executemany("INSERT INTO henkan_ledger (伝票番号, 行番号, 指紋, 変換日時) VALUES (?, ?, ?, ?)", rows)
+
+
+def ledger_summary(conn):
+    """ 変換履歴の (伝票数, 行数, 最終登録日時) を返す """
+    return conn.execute(
+        "SELECT COUNT(DISTINCT 伝票番号), COUNT(*), MAX(変換日時) FROM henkan_ledger"
+    ).fetchone()
+
+
+def clear_ledger(conn):
+    """ 変換履歴をすべて削除する（新しい会計年度で伝票No. が振り直された場合など） """
+    with conn:
+        conn.execute("DELETE FROM henkan_ledger")
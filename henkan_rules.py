@@ -0,0 +1,242 @@
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from lookup_keys import normalize_lookup_keys
+
+# ルールを適用する段階
+STAGE_JOURNAL = "仕訳"  # 弥生会計形式の仕訳（科目の割り当て前。normalize_journal で適用）
+STAGE_SUB_ACCOUNT = "補助科目"  # 財務R4形式の仕訳（補助科目の照合後。update_df_book で適用）
+STAGES = [STAGE_JOURNAL, STAGE_SUB_ACCOUNT]
+
+# 「両方」は借方・貸方の順に2つのルールとして適用する。列名の {貸借} はルールの側、{相手} は反対側に置き換える
+SIDES = ["借方", "貸方", "両方"]
+_OTHER_SIDE = {"借方": "貸方", "貸方": "借方"}
+
+# 条件（「いずれか」の条件値は「、」または「,」区切り。文字列はマスタとの照合と同じく表記ゆれを吸収して比較する）
+CONDITIONS = ["空欄", "空欄以外", "一致", "不一致", "いずれか"]
+# 設定方法（値: 設定値を入れる／列: 設定値に指定した列の値を写す／空欄: 値を消す）
+ACTIONS = ["値", "列", "空欄"]
+
+# henkan_rules テーブルの列
+RULE_COLUMNS = [
+    "管理番号", "順序", "段階", "貸借", "条件列", "条件", "条件値", "条件列2", "条件2", "条件値2",
+    "設定列", "設定方法", "設定値", "有効", "説明"
+]
+
+_SONOTA_ACCOUNTS = "材料仕入高、C消耗品費、C外注加工費"
+
+# 既定のルール（これまで変換処理に組み込まれていた特例）。順序の小さいものから適用する
+DEFAULT_RULES = [
+    # 諸口の補完（金額を先に補完してから科目を入れる）
+    {"順序": 10, "段階": STAGE_JOURNAL, "貸借": "両方", "条件列": "{貸借}勘定科目", "条件": "空欄",
+     "設定列": "{貸借}金額", "設定方法": "列", "設定値": "{相手}金額", "説明": "勘定科目が空欄の行は相手側の金額で補完する"},
+    {"順序": 20, "段階": STAGE_JOURNAL, "貸借": "両方", "条件列": "{貸借}勘定科目", "条件": "空欄",
+     "設定列": "{貸借}勘定科目", "設定方法": "値", "設定値": "諸口", "説明": "勘定科目が空欄の行は諸口とする"},
+    # 賃貸収入の科目振替
+    {"順序": 30, "段階": STAGE_JOURNAL, "貸借": "両方", "条件列": "{貸借}補助科目", "条件": "一致", "条件値": "賃貸収入",
+     "設定列": "{貸借}勘定科目", "設定方法": "値", "設定値": "賃貸収入", "説明": "補助科目が賃貸収入の行は勘定科目を賃貸収入にする"},
+    {"順序": 40, "段階": STAGE_JOURNAL, "貸借": "両方", "条件列": "{貸借}補助科目", "条件": "一致", "条件値": "賃貸収入",
+     "設定列": "{貸借}補助科目", "設定方法": "値", "設定値": "", "説明": "同じ行の補助科目は空欄にする"},
+    # 補助科目がマスタにない場合の補助
+    {"順序": 110, "段階": STAGE_SUB_ACCOUNT, "貸借": "両方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "設定列": "{貸借}補助", "設定方法": "値", "設定値": "0", "説明": "補助科目がマスタにない場合は補助 0"},
+    {"順序": 120, "段階": STAGE_SUB_ACCOUNT, "貸借": "両方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "設定列": "{貸借}補助科目名", "設定方法": "値", "設定値": "", "説明": "補助科目名は空欄"},
+    {"順序": 130, "段階": STAGE_SUB_ACCOUNT, "貸借": "両方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "条件列2": "{貸借}科目名", "条件2": "一致", "条件値2": "商品売上高",
+     "設定列": "{貸借}補助", "設定方法": "値", "設定値": "19", "説明": "商品売上高は補助 19（その他）"},
+    {"順序": 140, "段階": STAGE_SUB_ACCOUNT, "貸借": "両方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "条件列2": "{貸借}科目名", "条件2": "一致", "条件値2": "商品売上高",
+     "設定列": "{貸借}補助科目名", "設定方法": "値", "設定値": "その他"},
+    {"順序": 150, "段階": STAGE_SUB_ACCOUNT, "貸借": "両方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "条件列2": "{貸借}科目名", "条件2": "いずれか", "条件値2": _SONOTA_ACCOUNTS,
+     "設定列": "{貸借}補助", "設定方法": "値", "設定値": "99", "説明": "材料仕入高・C消耗品費・C外注加工費は補助 99（その他）"},
+    {"順序": 160, "段階": STAGE_SUB_ACCOUNT, "貸借": "両方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "条件列2": "{貸借}科目名", "条件2": "いずれか", "条件値2": _SONOTA_ACCOUNTS,
+     "設定列": "{貸借}補助科目名", "設定方法": "値", "設定値": "その他"},
+    # 貸方科目が材料仕入高・C消耗品費・C外注加工費の場合は借方補助を 99 とし、貸方補助は設定しない
+    {"順序": 170, "段階": STAGE_SUB_ACCOUNT, "貸借": "貸方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "条件列2": "{貸借}科目名", "条件2": "いずれか", "条件値2": _SONOTA_ACCOUNTS,
+     "設定列": "{相手}補助", "設定方法": "値", "設定値": "99", "説明": "貸方が材料仕入高などの場合は借方補助を 99（その他）にする"},
+    {"順序": 180, "段階": STAGE_SUB_ACCOUNT, "貸借": "貸方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "条件列2": "{貸借}科目名", "条件2": "いずれか", "条件値2": _SONOTA_ACCOUNTS,
+     "設定列": "{相手}補助科目名", "設定方法": "値", "設定値": "その他"},
+    {"順序": 190, "段階": STAGE_SUB_ACCOUNT, "貸借": "貸方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "条件列2": "{貸借}科目名", "条件2": "いずれか", "条件値2": _SONOTA_ACCOUNTS,
+     "設定列": "{貸借}補助", "設定方法": "空欄", "説明": "貸方補助は設定しない"},
+    {"順序": 200, "段階": STAGE_SUB_ACCOUNT, "貸借": "貸方", "条件列": "{貸借}補助照合", "条件": "一致", "条件値": "不一致",
+     "条件列2": "{貸借}科目名", "条件2": "いずれか", "条件値2": _SONOTA_ACCOUNTS,
+     "設定列": "{貸借}補助科目名", "設定方法": "空欄"},
+    # 補助が空白の場合の科目コードからの補完。従来は科目コード（文字列）を数値と比較していたため適用されておらず、既定では無効
+    {"順序": 210, "段階": STAGE_SUB_ACCOUNT, "貸借": "両方", "条件列": "{貸借}補助", "条件": "空欄",
+     "条件列2": "{貸借}科目", "条件2": "一致", "条件値2": "810",
+     "設定列": "{貸借}補助", "設定方法": "値", "設定値": "19", "有効": 0, "説明": "補助が空欄で科目コード 810 の場合は補助 19"},
+    {"順序": 220, "段階": STAGE_SUB_ACCOUNT, "貸借": "両方", "条件列": "{貸借}補助", "条件": "空欄",
+     "条件列2": "{貸借}科目", "条件2": "いずれか", "条件値2": "401、435、448",
+     "設定列": "{貸借}補助", "設定方法": "値", "設定値": "99", "有効": 0,
+     "説明": "補助が空欄で科目コード 401・435・448 の場合は補助 99"},
+]
+
+# 展開済みのルール。conditions は (列名, 条件, 条件値のリスト) のリスト
+_Rule = namedtuple("_Rule", ["conditions", "target", "action", "value"])
+
+_VALUE_SEPARATOR = re.compile(r"[、,]")
+
+
+def default_rules_frame():
+    """ 既定のルールを henkan_rules テーブルと同じ列の DataFrame で返す """
+    rules = pd.DataFrame(DEFAULT_RULES, columns=RULE_COLUMNS)
+    rules["管理番号"] = [f"default-{order:03d}" for order in rules["順序"]]
+    rules["有効"] = rules["有効"].fillna(1).astype(int)
+    return rules
+
+
+def default_rule_rows():
+    """ 既定のルールを henkan_rules に登録する行（RULE_COLUMNS の順の値のリスト）で返す """
+    rules = default_rules_frame()
+    return rules.astype(object).where(rules.notna(), None).to_numpy().tolist()
+
+
+def read_rules(conn):
+    """ データベースのルールを適用順に読み込む（henkan_rules がない古いデータベースでは既定のルール） """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'henkan_rules'").fetchone()
+    if not exists:
+        return default_rules_frame()
+    return pd.read_sql_query(f"SELECT {', '.join(RULE_COLUMNS)} FROM henkan_rules ORDER BY 順序, rowid", conn)
+
+
+def reset_rules(conn):
+    """ ルールをすべて削除し、既定のルールに戻す """
+    with conn:
+        conn.execute("DELETE FROM henkan_rules")
+        conn.executemany(
+            f"INSERT INTO henkan_rules ({', '.join(RULE_COLUMNS)}) VALUES ({', '.join('?' for _ in RULE_COLUMNS)})",
+            default_rule_rows()
+        )
+
+
+def _text(value):
+    return "" if value is None or (not isinstance(value, str) and pd.isna(value)) else str(value).strip()
+
+
+def _is_enabled(value):
+    # 有効が空欄のルールは有効として扱う
+    return value is None or pd.isna(value) or bool(value)
+
+
+def compile_rules(rules, columns):
+    """
+    ルールの表（henkan_rules の行）を、段階ごとの適用順のリストに展開する（無効のルールは検証だけ行う）。
+    貸借・設定方法が空欄の場合は「両方」「値」。columns は {段階: (条件に使える列, 設定できる列)}。不正なルールがあれば ValueError
+    """
+    compiled = {stage: [] for stage in STAGES}
+    rules = rules.assign(_order=pd.to_numeric(rules["順序"], errors="coerce"))
+    for rule in rules.sort_values("_order", kind="stable").to_dict("records"):
+        enabled = _is_enabled(rule["有効"])
+        order = "未入力" if pd.isna(rule["_order"]) else f"{rule['_order']:g}"
+
+        def invalid(message):
+            return ValueError(f"変換ルール（順序 {order}）: {message}")
+
+        if pd.isna(rule["_order"]):
+            raise invalid("順序は数値で入力してください。")
+        stage, side, action = _text(rule["段階"]), _text(rule["貸借"]) or "両方", _text(rule["設定方法"]) or "値"
+        if stage not in STAGES:
+            raise invalid(f"段階は {'・'.join(STAGES)} のいずれかを指定してください。")
+        if side not in SIDES:
+            raise invalid(f"貸借は {'・'.join(SIDES)} のいずれかを指定してください。")
+        if action not in ACTIONS:
+            raise invalid(f"設定方法は {'・'.join(ACTIONS)} のいずれかを指定してください。")
+        readable, writable = columns[stage]
+
+        for rule_side in (["借方", "貸方"] if side == "両方" else [side]):
+            def column_name(name):
+                return _text(name).replace("{貸借}", rule_side).replace("{相手}", _OTHER_SIDE[rule_side])
+
+            conditions = []
+            for suffix in ["", "2"]:
+                column = column_name(rule[f"条件列{suffix}"])
+                if not column:
+                    continue
+                condition = _text(rule[f"条件{suffix}"])
+                if condition not in CONDITIONS:
+                    raise invalid(f"条件は {'・'.join(CONDITIONS)} のいずれかを指定してください。")
+                if column not in readable:
+                    raise invalid(f"条件列「{column}」は{stage}の段階では使えません。")
+                text = _text(rule[f"条件値{suffix}"])
+                values = [v.strip() for v in _VALUE_SEPARATOR.split(text)] if condition == "いずれか" else [text]
+                conditions.append((column, condition, values))
+
+            target = column_name(rule["設定列"])
+            if target not in writable:
+                raise invalid(f"設定列「{target}」は{stage}の段階では設定できません。")
+            value = _text(rule["設定値"])
+            if action == "列":
+                value = column_name(value)
+                if value not in readable:
+                    raise invalid(f"設定値の列「{value}」は{stage}の段階では使えません。")
+            if enabled:
+                compiled[stage].append(_Rule(conditions, target, action, value))
+    return compiled
+
+
+def _typed_values(values, column):
+    # 条件値・設定値（文字列）を列の型に合わせる
+    if pd.api.types.is_numeric_dtype(column):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").tolist()
+    return values
+
+
+def _condition_mask(column, condition, values, column_keys):
+    # column_keys は列の照合用のキー（normalize_lookup_keys）を返す関数
+    if condition in ("空欄", "空欄以外"):
+        blank = (column.isna() | (column == "")).to_numpy()
+        return blank if condition == "空欄" else ~blank
+    if pd.api.types.is_numeric_dtype(column):
+        mask = column.isin(_typed_values(values, column)).to_numpy()
+    else:
+        mask = column_keys().isin(normalize_lookup_keys(values)).to_numpy()
+    return ~mask if condition == "不一致" else mask
+
+
+def apply_rules(frame, rules, extra_columns=None):
+    """
+    展開済みのルール（compile_rules の1段階分）を順に frame へ適用する。
+    ルールごとに条件を列全体のマスクとして評価し、該当する行へまとめて設定する。
+    extra_columns は条件にだけ使える列（{列名: frame と同じ行数の Series}）
+    """
+    extra_columns = extra_columns or {}
+    # 同じ条件・同じ列を続けて使うルールが多いため、条件のマスクと列の照合用のキーは列が変更されるまで使い回す
+    masks = {}
+    lookup_keys = {}
+
+    def column(name):
+        return extra_columns[name] if name in extra_columns else frame[name]
+
+    def column_keys(name):
+        if name not in lookup_keys:
+            lookup_keys[name] = pd.Series(normalize_lookup_keys(column(name)))
+        return lookup_keys[name]
+
+    for rule in rules:
+        mask = np.ones(len(frame), dtype=bool)
+        for name, condition, values in rule.conditions:
+            key = (name, condition, tuple(values))
+            if key not in masks:
+                masks[key] = _condition_mask(column(name), condition, values, lambda: column_keys(name))
+            mask &= masks[key]
+        if not mask.any():
+            continue
+        for key in [key for key in masks if key[0] == rule.target]:
+            del masks[key]
+        lookup_keys.pop(rule.target, None)
+        if rule.action == "空欄":
+            frame.loc[mask, rule.target] = np.nan
+        elif rule.action == "列":
+            frame.loc[mask, rule.target] = column(rule.value)[mask]
+        else:
+            frame.loc[mask, rule.target] = _typed_values([rule.value], frame[rule.target])[0]
+    return frame
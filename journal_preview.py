@@ -0,0 +1,86 @@
+import math
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+PAGE_SIZES = [50, 100, 500, 1000]
+
+
+def show_journal_summary(df, df_book, unmapped):
+    """ 変換結果の件数・金額・期間を表示する """
+    dates = pd.to_datetime(df["日付"], errors="coerce")
+    period = f"{dates.min():%Y/%m/%d} 〜 {dates.max():%Y/%m/%d}" if dates.notna().any() else "-"
+
+    cols = st.columns(6)
+    cols[0].metric("仕訳行数", f"{len(df_book):,}")
+    cols[1].metric("伝票数", f"{df['伝票No.'].nunique():,}")
+    cols[2].metric("借方金額合計", f"{pd.to_numeric(df['借方金額'], errors='coerce').sum():,.0f}")
+    cols[3].metric("貸方金額合計", f"{pd.to_numeric(df['貸方金額'], errors='coerce').sum():,.0f}")
+    cols[4].metric("期間", period)
+    cols[5].metric("マスタ未登録の行", f"{int(unmapped.sum()):,}")
+
+
+def _filter_rows(df, unmapped, slip_no, unmapped_only):
+    mask = np.ones(len(df), dtype=bool)
+    if unmapped_only:
+        mask &= unmapped
+    if slip_no:
+        slip = pd.to_numeric(slip_no, errors="coerce")
+        if pd.isna(slip):
+            st.error("伝票No.は数字で入力してください。")
+        else:
+            mask &= (df["伝票No."] == slip).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def show_journal_preview(df, df_book, unmapped, key="journal_preview"):
+    """
+    弥生会計形式と財務R4形式の仕訳を、絞り込み・ページ分割して表示する。
+    ブラウザに送るのは表示中のページの行だけ
+    """
+    filter_cols = st.columns([2, 2, 1])
+    slip_no = filter_cols[0].text_input("伝票No.で絞り込み", key=f"{key}_slip").strip()
+    unmapped_only = filter_cols[1].checkbox("マスタ未登録の行のみ表示", key=f"{key}_unmapped")
+    page_size = filter_cols[2].selectbox("表示件数", PAGE_SIZES, key=f"{key}_page_size")
+
+    positions = _filter_rows(df, unmapped, slip_no, unmapped_only)
+    if len(positions) == 0:
+        st.info("条件に一致する仕訳はありません。")
+        return
+
+    pages = math.ceil(len(positions) / page_size)
+    # 絞り込みで総ページ数が減った場合は最終ページに合わせる
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    page = st.number_input(f"ページ（全{pages}ページ）", min_value=1, max_value=pages, key=f"{key}_page")
+    start = (page - 1) * page_size
+    shown = positions[start:start + page_size]
+    st.caption(f"{len(positions):,}件中 {start + 1:,}〜{start + len(shown):,}件目")
+
+    tab_book, tab_yayoi = st.tabs(["R4形式 仕訳データプレビュー", "弥生会計形式 仕訳データプレビュー"])
+    with tab_book:
+        st.dataframe(df_book.iloc[shown])
+    with tab_yayoi:
+        st.dataframe(df.iloc[shown])
+
+
+def show_unmapped_keys(unmapped_keys, key="unmapped_keys"):
+    """ 変換前の確認で見つかったマスタ未登録のキー（find_unmapped_keys の結果）を表示する """
+    is_sub_account = (unmapped_keys["区分"] == "補助科目").to_numpy()
+    missing = unmapped_keys[~is_sub_account]
+    if len(missing):
+        st.warning(
+            f"マスタに登録されていない勘定科目・税区分が {len(missing):,} 件あります（延べ {missing['件数'].sum():,} 行）。"
+            "設定のページでマスタに登録してから変換してください。"
+        )
+    if is_sub_account.any():
+        st.info(
+            f"マスタに見つからない補助科目が {int(is_sub_account.sum()):,} 件あります。"
+            "これらの仕訳の補助は変換ルールで設定されます（既定では 0・その他）。"
+        )
+    st.dataframe(unmapped_keys, hide_index=True)
+    st.download_button(
+        "未登録の一覧をCSVでダウンロード", unmapped_keys.to_csv(index=False).encode("utf-8-sig"),
+        file_name="マスタ未登録の一覧.csv", mime="text/csv", key=f"{key}_download"
+    )
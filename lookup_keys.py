@@ -0,0 +1,27 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# 括弧の種類をそろえる（全角の（）［］は NFKC で半角になる）
+_BRACKETS = str.maketrans({
+    "[": "(", "]": ")", "【": "(", "】": ")", "〔": "(", "〕": ")", "〈": "(", "〉": ")", "《": "(", "》": ")",
+})
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_lookup_keys(values):
+    """
+    マスタとの照合に使うキーにする（NFKC 正規化・空白の除去・括弧の統一）。
+    全角と半角、前後や途中の空白、（）と () などの表記ゆれが同じキーになる。
+    値の種類ごとに1回だけ変換して全行に展開する。戻り値は object 型の ndarray（欠損値は NaN のまま）
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    keys = (
+        pd.Series(uniques, dtype=object).map(str)
+        .str.normalize("NFKC")
+        .str.replace(_WHITESPACE, "", regex=True)
+        .str.translate(_BRACKETS)
+    )
+    # 欠損値（code = -1）は末尾の NaN になる
+    return np.append(keys.to_numpy(dtype=object), np.nan)[codes]
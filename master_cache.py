@@ -0,0 +1,116 @@
+import os
+import threading
+from collections import OrderedDict
+
+from connection_manager import open_connection
+from database import read_master_revision
+from henkan_core import load_masters
+
+# 同時に保持するデータベースの上限（超えた場合は最も長く使われていないものから破棄）
+DEFAULT_MAX_DATABASES = 32
+
+
+class _Entry:
+    def __init__(self, file_id, probe_conn):
+        self.file_id = file_id
+        # 変更検知専用の接続。PRAGMA data_version は「他の接続」によるコミットで値が変わる
+        self.probe_conn = probe_conn
+        self.data_version = None
+        # マスタ・変換ルールの改版番号（変換履歴など、マスタ以外のコミットでは読み直さない）
+        self.revision = None
+        self.masters = None
+        # 読み込みはデータベースごとに排他する（遅い読み込みが他のデータベースの参照を待たせない）
+        self.lock = threading.Lock()
+        self.discarded = False
+
+    def discard(self):
+        # 読み込み中であれば、読み込んでいるスレッドが終わったあとに閉じる
+        self.discarded = True
+        if self.lock.acquire(blocking=False):
+            try:
+                self.probe_conn.close()
+            finally:
+                self.lock.release()
+
+
+class MasterCache:
+    """ データベースごとに索引化済みのマスタを保持するキャッシュ（プロセス全体で共有） """
+
+    def __init__(self, max_databases=DEFAULT_MAX_DATABASES):
+        self.max_databases = max_databases
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db_path):
+        """ db_path のマスタを返す。前回の読み込み以降にマスタが変更されていれば読み直す """
+        key = os.path.abspath(db_path)
+        file_id = _file_id(key)
+        while True:
+            entry = self._entry(key, file_id)
+            with entry.lock:
+                if entry.discarded:
+                    # 待っている間に破棄された（同じパスへの別のアップロードなど）。取り直す
+                    continue
+                data_version = entry.probe_conn.execute("PRAGMA data_version").fetchone()[0]
+                if entry.masters is None or entry.data_version != data_version:
+                    # 何かがコミットされた。改版番号が変わっていなければマスタはそのまま使う
+                    # （改版番号がない古いスキーマでは、コミットのたびに読み直す）
+                    revision = read_master_revision(entry.probe_conn)
+                    if entry.masters is None or revision is None or entry.revision != revision:
+                        entry.masters = load_masters(entry.probe_conn)
+                        entry.revision = revision
+                    entry.data_version = data_version
+                if entry.discarded:
+                    # 読み込み中に破棄された。結果は返し、接続はここで閉じる
+                    entry.probe_conn.close()
+                return entry.masters
+
+    def _entry(self, key, file_id):
+        # 一覧の操作だけを全体のロックで行う（マスタの読み込みはロックの外）
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.file_id != file_id:
+                # 同じパスに別のファイルがアップロードされた
+                self._discard(key)
+                entry = None
+            if entry is None:
+                entry = _Entry(file_id, open_connection(key))
+                self._entries[key] = entry
+                self._evict()
+            self._entries.move_to_end(key)
+            return entry
+
+    def invalidate(self, db_path=None):
+        """ 指定したデータベース（省略時はすべて）のキャッシュを破棄する """
+        with self._lock:
+            keys = list(self._entries) if db_path is None else [os.path.abspath(db_path)]
+            for key in keys:
+                self._discard(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        while len(self._entries) > self.max_databases:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.discard()
+
+
+def _file_id(path):
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino
+
+
+_cache = MasterCache()
+
+
+def get_masters(db_path):
+    return _cache.get(db_path)
+
+
+def invalidate_masters(db_path=None):
+    _cache.invalidate(db_path)
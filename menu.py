@@ -1,8 +1,12 @@
-import os
-import tempfile
-import sqlite3
+import uuid
 from pathlib import Path
 import streamlit as st
+from database import initialize_tables, find_duplicate_lookup_keys, empty_database_bytes, check_database_integrity
+from connection_manager import get_connection, close_connections
+from master_cache import invalidate_masters
+from temp_storage import (
+    file_digest, file_signature, store_upload, discard_upload, touch_temp_file, cleanup_temp_files
+)
 
 # ページ設定
 st.set_page_config(layout="wide")
@@ -18,6 +22,7 @@ with st.sidebar:
     st.page_link("pages/setting_kamoku.py", label="&nbsp;&nbsp;勘定科目設定")
     st.page_link("pages/setting_hojo.py", label="&nbsp;&nbsp;補助科目設定")
     st.page_link("pages/setting_syouhizei.py", label="&nbsp;&nbsp;消費税設定")
+    st.page_link("pages/setting_rules.py", label="&nbsp;&nbsp;変換ルール設定")
 
     st.markdown('<div class="section orange">データベースへのインポート</div>', unsafe_allow_html=True)
     st.page_link("pages/import_kamoku.py", label="&nbsp;&nbsp;勘定科目マスタインポート")
@@ -57,82 +62,78 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-def initialize_tables(conn):
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS kamoku_master (
-            管理番号 TEXT PRIMARY KEY,     
-            財務R4科目コード TEXT NOT NULL,
-            財務R4科目名 TEXT NOT NULL,
-            弥生会計科目名 TEXT
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS hojo_master (
-            管理番号 TEXT PRIMARY KEY, 
-            財務R4科目コード TEXT NOT NULL,
-            財務R4科目名 TEXT NOT NULL, 
-            財務R4補助科目コード TEXT NOT NULL,
-            財務R4補助科目名 TEXT, 
-            弥生会計補助科目名 TEXT
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS syouhizei_master (
-            管理番号 TEXT PRIMARY KEY,  
-            財務R4税コード TEXT NOT NULL,
-            財務R4税率 TEXT,
-            財務R4インボイス TEXT,
-            財務R4簡易課税 TEXT,
-            弥生会計税区分 TEXT
-        )
-    """)
-
-    conn.commit()
+def connect_uploaded_db(uploaded_file):
+    """ アップロードされたDBをセッション専用の場所に保存して接続する """
+    session_id = st.session_state.setdefault("storage_session_id", uuid.uuid4().hex)
+    digest = file_digest(uploaded_file)
+
+    # 同じ内容のファイルに接続済みで、接続後に変更もされていなければ書き込みも再接続もしない
+    current = st.session_state.get("uploaded_db")
+    if (current and current["digest"] == digest and st.session_state.get("db_path") == current["db_path"]
+            and file_signature(current["db_path"]) == current["signature"]):
+        st.success("同じ内容のDBに接続済みです（アップロード）")
+        return
+
+    # 上書きする前に現在の接続を閉じる（各ページは必要になった時点で開き直す）
+    previous_path = st.session_state.get("db_path")
+    if previous_path:
+        close_connections(previous_path)
+        invalidate_masters(previous_path)
+
+    db_path = store_upload(session_id, uploaded_file.name, uploaded_file, digest)
+    problems = check_database_integrity(db_path, digest)
+    if problems:
+        discard_upload(db_path)
+        st.session_state.pop("uploaded_db", None)
+        st.error("アップロードされたファイルが壊れているか、SQLiteのデータベースではありません。")
+        st.write(problems)
+        return
+
+    conn = get_connection(db_path)
+    initialize_tables(conn)
+    st.session_state.db_path = db_path
+    st.session_state.uploaded_db = {"digest": digest, "db_path": db_path, "signature": file_signature(db_path)}
+    if previous_path and previous_path != db_path:
+        discard_upload(previous_path)
+    st.success("DBに接続しました（アップロード）")
+
+    # 仕訳変換で照合に使うキーの重複チェック（重複していると先頭の行だけが使われる）
+    for table, duplicates in find_duplicate_lookup_keys(conn).items():
+        st.warning(f"{table} に照合キーが重複している行があります（先頭の行が使われます）。")
+        st.dataframe(duplicates)
+
 
 def handle_file_upload_and_create_db_ui():
     st.header("🔌 データベース接続")
 
     uploaded_file = st.file_uploader("SQLiteファイルをアップロードして接続", type=["db"])
     if uploaded_file is not None:
-        temp_dir = tempfile.gettempdir()
-        temp_db_path = os.path.join(temp_dir, uploaded_file.name)
-        with open(temp_db_path, "wb") as f:
-            f.write(uploaded_file.read())
-        
-        try:
-            conn = sqlite3.connect(temp_db_path, check_same_thread=False)
-            initialize_tables(conn)
-            st.session_state.conn = conn
-            st.session_state.db_path = temp_db_path
+        # アップローダーがファイルを保持している間の再実行では何もしない
+        if st.session_state.get("uploaded_file_id") != uploaded_file.file_id:
+            st.session_state.uploaded_file_id = uploaded_file.file_id
+            try:
+                connect_uploaded_db(uploaded_file)
+            except Exception as e:
+                st.error(f"DB接続に失敗しました: {e}")
+        elif "uploaded_db" in st.session_state:
             st.success("DBに接続しました（アップロード）")
-        except Exception as e:
-            st.error(f"DB接続に失敗しました: {e}")
 
     st.divider()
 
 st.title("📥 データベースを新規作成")
 
-# 一時ファイルでDB作成
-with tempfile.NamedTemporaryFile(delete=False, suffix=".db") as tmpfile:
-    db_path = tmpfile.name
-
-conn = sqlite3.connect(db_path)
-initialize_tables(conn)
-
-# DBを保存してダウンロードリンクを表示
-with open(db_path, "rb") as f:
-    db_data = f.read()
-
+# 空のDBはプロセスごとに1回だけ作成し、そのバイト列を使い回す
 st.download_button(
     label="📁 新規データベースをダウンロード",
-    data=db_data,
+    data=empty_database_bytes(),
     file_name="my_database.db",
     mime="application/octet-stream"
 )
 
 
 handle_file_upload_and_create_db_ui()
+
+# 放棄されたアップロードDBの掃除（接続中のDBは対象外。一定間隔ごとにしか走査しない）
+if "db_path" in st.session_state:
+    touch_temp_file(st.session_state.db_path)
+cleanup_temp_files(keep=[st.session_state.db_path] if "db_path" in st.session_state else [])
@@ -5,6 +5,24 @@ from PIL import Image
 import io
 from datetime import datetime
 import os
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from henkan_core import (
+    read_yayoi_file, normalize_journal, convert_journal_in_batches, write_r4_csv, convert_csv_in_chunks,
+    find_unmapped_rows, find_unmapped_keys
+)
+from diagnostics import NULL_TIMER, StageTimer, profile_call
+from henkan_batch import WORKER_CONTEXT, init_worker, convert_uploaded_bytes, output_file_name
+from henkan_jobs import ConversionJob, JobCancelled, DONE, CANCELLED
+from henkan_ledger import (
+    NEW, CHANGED, CONVERTED, journal_fingerprints, classify_entries, record_entries, ledger_summary, clear_ledger
+)
+from journal_preview import show_journal_summary, show_journal_preview, show_unmapped_keys
+from master_cache import get_masters
+from session_db import get_session_connection
+from temp_storage import touch_temp_file, store_upload, temp_file_path, discard_upload
 
 st.set_page_config(layout="wide")
 
@@ -24,6 +42,7 @@ with st.sidebar:
     st.page_link("pages/setting_kamoku.py", label="&nbsp;&nbsp;勘定科目設定")
     st.page_link("pages/setting_hojo.py", label="&nbsp;&nbsp;補助科目設定")
     st.page_link("pages/setting_syouhizei.py", label="&nbsp;&nbsp;消費税設定")
+    st.page_link("pages/setting_rules.py", label="&nbsp;&nbsp;変換ルール設定")
 
     st.markdown('<div class="section orange">データベースへのインポート</div>', unsafe_allow_html=True)
     st.page_link("pages/import_kamoku.py", label="&nbsp;&nbsp;勘定科目マスタインポート")
@@ -84,205 +103,444 @@ if "db_path" in st.session_state:
 else:
     st.error("データベースに接続していません。menu.pyで接続してください。")
 
-uploaded_file = st.file_uploader("弥生会計から出力したCSVファイルをアップロード", type=["csv", "xlsx"])
+uploaded_files = st.file_uploader(
+    "弥生会計から出力したCSVファイルをアップロード（複数選択可）", type=["csv", "xlsx"], accept_multiple_files=True
+)
+# 1ファイルの場合はプレビュー付きで変換し、複数ファイルの場合はまとめて変換してZIPで出力する
+uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
 
 @st.cache_data
 def load_file(uploaded_file):
-    if uploaded_file.name.endswith('.csv'):
-        try:
-            df = pd.read_csv(uploaded_file, header=None, encoding="cp932")
-        except UnicodeDecodeError:
-            df = pd.read_csv(uploaded_file, header=None, encoding="utf-8", errors="replace")
-    elif uploaded_file.name.endswith('.xlsx'):
-        df = pd.read_excel(uploaded_file, header=None)
+    try:
+        return read_yayoi_file(uploaded_file, uploaded_file.name)
+    except ValueError as e:
+        st.error(str(e))
+        return None
+
+def convert_upload(job, upload, masters, timer=NULL_TIMER):
+    """
+    アップロードされた仕訳を変換し、プレビューとダウンロードに使う結果をまとめて返す（バックグラウンドで実行する）。
+    upload は開始時に取り出したファイルの内容と読み込み結果で、スレッドからはアップロードに触れない
+    """
+    if timer is not NULL_TIMER:
+        # 計測時は読み込みもキャッシュを使わずに実行する
+        job.report(0, stage="読み込み")
+        df = read_yayoi_file(io.BytesIO(upload["data"]), upload["name"], timer)
     else:
-        st.error("対応ファイル形式は .csv です。")
+        df = upload["df"]
+    job.report(0, len(df), "変換")
+
+    # 変換履歴の指紋は変換ルールを適用する前の仕訳から求める（ルールを変えても変換済みの伝票が「変更」にならない）
+    fingerprints = None
+    if upload["fingerprints"]:
+        with timer.stage("変換履歴の指紋", len(df)):
+            fingerprints = journal_fingerprints(df)
+
+    # 諸口の補完と賃貸収入の科目振替
+    with timer.stage("諸口・賃貸収入の補正", len(df)):
+        normalize_journal(df, masters["rules"])
+
+    # CSVをバイナリ形式でエクスポート（Excel文字化け回避のためutf-8-sig）
+    export = io.BytesIO()
+    df_book = convert_journal_in_batches(df, masters, export, timer=timer, progress=job.report)
+    return {
+        "file_id": upload["file_id"],
+        "masters": masters,
+        "df": df,
+        "df_book": df_book,
+        "unmapped": find_unmapped_rows(df, df_book),
+        "csv": export.getvalue(),
+        **({"fingerprints": fingerprints} if fingerprints is not None else {}),
+    }
+
+
+def preflight_check(uploaded_file, masters):
+    """
+    変換の前にマスタの登録状況を確認する。未登録の勘定科目・税区分があり、このファイルで「このまま変換する」が
+    選ばれていなければ、一覧を表示して処理を止める。戻り値は未登録のキーの一覧
+    """
+    df = load_file(uploaded_file)
+    if df is None:
+        st.stop()
+    start = time.perf_counter()
+    unmapped_keys = find_unmapped_keys(df, masters)
+    seconds = time.perf_counter() - start
+
+    if (unmapped_keys["区分"] != "補助科目").any() and st.session_state.get("henkan_preflight_accepted") != uploaded_file.file_id:
+        st.subheader("変換前の確認")
+        show_unmapped_keys(unmapped_keys, key="henkan_preflight")
+        st.caption(f"{len(df):,}行をマスタと照合しました（{seconds:.2f}秒）。マスタを登録すると自動で再確認します。")
+
+        def accept():
+            st.session_state.henkan_preflight_accepted = uploaded_file.file_id
+
+        st.button("このまま変換する", on_click=accept)
+        st.stop()
+    return unmapped_keys
+
+
+def find_job(mode, files, masters, diagnostics_level=0, fingerprints=False):
+    """ 同じ方法・アップロード・マスタで開始した変換のジョブを返す（診断や指紋が足りない場合やない場合は None） """
+    job = st.session_state.get("henkan_job")
+    if job is None:
         return None
+    key = job.key
+    if (key["mode"] == mode and key["files"] == files and key["masters"] is masters
+            and key["level"] >= diagnostics_level and key["fingerprints"] >= fingerprints):
+        return job
+    return None
+
+
+def start_job(func, mode, files, masters, diagnostics_level=0, label="", unit="行", fingerprints=False, temp_paths=()):
+    """ 変換をバックグラウンドで開始して session_state に保存する（このセッションで実行中の前の変換は取り消す） """
+    previous = st.session_state.get("henkan_job")
+    if previous is not None:
+        previous.cancel()
+        discard_job_files(previous)
+    key = {"mode": mode, "files": files, "masters": masters, "level": diagnostics_level, "fingerprints": fingerprints}
+    job = ConversionJob(func, key=key, label=label, unit=unit, temp_paths=temp_paths).start()
+    st.session_state.henkan_job = job
+    return job
+
+
+def discard_job_files(job):
+    # 取り消し中のジョブが書き込んでいるファイルは削除できない場合がある（その場合は一時ファイルの掃除に任せる）
+    for path in job.temp_paths:
+        discard_upload(path)
+
+
+def discard_job():
+    """ 変換のジョブと結果を破棄する（アップロードがあれば次の実行で変換し直す） """
+    job = st.session_state.get("henkan_job")
+    if job is not None:
+        discard_job_files(job)
+    for key in ["henkan_job", "henkan_result", "henkan_batch_result"]:
+        st.session_state.pop(key, None)
+
+
+def count_lines(path):
+    """ ファイルの行数（改行の数）を、全体を読み込まずに数える """
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return lines + (last != b"\n")
+
+
+@st.fragment(run_every=1)
+def show_job_progress(job):
+    """ 実行中の変換の進捗を1秒ごとに更新する。終了したらページ全体を再実行して結果を表示する """
+    if not job.running:
+        st.rerun()
+    st.progress(job.fraction(), text=job.progress_text())
+    st.button(
+        "取り消し中..." if job.cancelling else "変換を取り消す",
+        on_click=job.cancel, disabled=job.cancelling, key=f"henkan_cancel_{job.id}"
+    )
+    st.caption("変換中も他のページを開けます。このページに戻ると進捗と結果を表示します。")
 
-    df.columns = [
-        "識別フラグ", "伝票No.", "決算", "取引日付", "借方勘定科目", "借方補助科目", "借方部門", "借方税区分",
-        "借方金額", "借方税金額", "貸方勘定科目", "貸方補助科目", "貸方部門", "貸方税区分", "貸方金額", "貸方税金額",
-        "摘要", "番号", "期日", "タイプ", "生成元", "仕訳メモ", "付箋1", "付箋2", "調整"
-    ]
-
-    def wareki_to_date_simple(date_str):
-        if isinstance(date_str, str) and date_str.startswith("R."):
-            try:
-                date_str = date_str.replace("R.", "")
-                year, month, day = map(int, date_str.split("/"))
-                seireki_year = 2018 + year
-                return f"{seireki_year}/{month:02d}/{day:02d}"
-            except:
-                return date_str
-        return date_str
-
-    df.rename(columns={
-        "取引日付": "日付",
-        "借方税金額": "借方税額",
-        "貸方税金額": "貸方税額"
-    }, inplace=True)
-
-    if "日付" in df.columns:
-        df["日付"] = df["日付"].apply(wareki_to_date_simple)
-        df["日付"] = pd.to_datetime(df["日付"], errors="coerce").dt.date
-
-    return df
+
+def show_job_outcome(job):
+    """ 取り消された・失敗した変換の結果を表示して処理を止める """
+    if job.status == CANCELLED:
+        st.info(f"変換を取り消しました（{job.done:,}{job.unit}まで変換済み）。")
+    elif isinstance(job.error, ValueError):
+        st.error(str(job.error))
+    else:
+        st.exception(job.error)
+    st.button("もう一度変換する", on_click=discard_job)
+    st.stop()
+
+
+def wait_for_job(job):
+    """ 変換が終わるまでは進捗を表示して処理を止める。完了していれば変換結果を返す """
+    if job.running:
+        show_job_progress(job)
+        st.stop()
+    if job.status != DONE:
+        show_job_outcome(job)
+    return job.result
+
+
+def show_previous_job():
+    """ アップロードがない場合（他のページから戻ったときなど）に、このセッションの変換の進捗か結果を表示する """
+    job = st.session_state.get("henkan_job")
+    if job is None:
+        return
+    st.subheader(f"変換中・変換済みのファイル: {job.label}")
+    if job.running:
+        show_job_progress(job)
+        return
+    if job.status != DONE:
+        show_job_outcome(job)
+
+    db_name = os.path.splitext(os.path.basename(st.session_state.get("db_path", "")))[0]
+    today = datetime.today().strftime("%Y%m%d")
+    st.success(f"変換が完了しました（{job.done:,}{job.unit}・{job.elapsed():.1f}秒）。")
+    if "zip" in job.result:
+        st.download_button(
+            label="ZIPをダウンロード",
+            data=job.result["zip"],
+            file_name=f"{db_name}_作成日:{today}.zip",
+            mime="application/zip"
+        )
+    else:
+        st.download_button(
+            label="CSVをダウンロード",
+            # 分割変換の結果は一時ファイルから読み込む
+            data=job.result["csv"] if "csv" in job.result else open(job.result["csv_path"], "rb"),
+            file_name=f"{db_name}_作成日:{today}.csv",
+            mime="application/octet-stream"
+        )
+    st.button("変換結果を閉じる", on_click=discard_job)
+
+def run_with_diagnostics(func, diagnostics_level, *args):
+    """ 診断の設定に従って func(*args, timer) を実行し、(戻り値, 処理時間の表, プロファイル) を返す """
+    if not diagnostics_level:
+        return func(*args, NULL_TIMER), None, None
+    timer = StageTimer()
+    if diagnostics_level >= 2:
+        result, dump, text = profile_call(func, *args, timer)
+        return result, timer.summary(), (dump, text)
+    return func(*args, timer), timer.summary(), None
+
+
+def show_diagnostics(timings, profile):
+    st.subheader("🔧 診断")
+    if timings is not None:
+        st.caption(f"合計 {timings['時間(秒)'].sum():.3f}秒")
+        st.dataframe(timings, hide_index=True)
+    if profile is not None:
+        dump, text = profile
+        st.download_button(
+            label="プロファイル（.prof）をダウンロード",
+            data=dump,
+            file_name="henkan.prof",
+            mime="application/octet-stream"
+        )
+        with st.expander("累積時間の上位30件"):
+            st.code(text)
+
+
+def show_incremental(result, csv_bytes, file_prefix):
+    """
+    変換履歴と照合し、新規の伝票だけを csv_bytes に書き出す。
+    前回の変換後に内容が変わった伝票は、二重に取り込まないよう別のCSVで出力する。
+    戻り値は出力した仕訳行の指紋（変換履歴への登録用）
+    """
+    conn = get_session_connection()
+    # 指紋は変換時に読み込んだままの仕訳から求めて結果と一緒に保持し、ページ送りなどの再実行では照合だけを行う
+    fingerprints = result["fingerprints"]
+    status = classify_entries(conn, fingerprints)
+    df, df_book = result["df"], result["df_book"]
+    is_new, is_changed = status == NEW, status == CHANGED
+
+    st.subheader("変換履歴との照合")
+    cols = st.columns(3)
+    for col, label in zip(cols, [NEW, CHANGED, CONVERTED]):
+        mask = status == label
+        col.metric(f"{label}の仕訳行", f"{mask.sum():,}（{df.loc[mask, '伝票No.'].nunique():,}伝票）")
+
+    write_r4_csv(df_book[is_new], csv_bytes)
+    if is_changed.any():
+        st.warning(
+            "前回の変換後に内容が変わった伝票があります。財務R4の該当伝票を確認のうえ、"
+            "必要に応じて「変更された仕訳のCSV」で取り込んでください。"
+        )
+        st.dataframe(df[is_changed], hide_index=True)
+        changed_csv = io.BytesIO()
+        write_r4_csv(df_book[is_changed], changed_csv)
+        st.download_button(
+            label="変更された仕訳のCSVをダウンロード",
+            data=changed_csv.getvalue(),
+            file_name=f"{file_prefix}_変更分.csv",
+            mime="application/octet-stream"
+        )
+
+    return fingerprints[is_new | is_changed]
+
+
+def show_ledger_actions(exported):
+    """ 出力した仕訳の変換履歴への登録と、変換履歴の管理 """
+    conn = get_session_connection()
+    st.button(
+        f"出力した仕訳（{len(exported):,}行）を変換履歴に登録する",
+        disabled=exported.empty,
+        on_click=record_entries, args=(conn, exported),
+        help="財務R4への取り込みが済んだら登録してください。次回から変換済みの仕訳として除外します。"
+    )
+    with st.expander("変換履歴の管理"):
+        slips, lines, last_converted = ledger_summary(conn)
+        st.write(f"登録済み: {slips:,}伝票 / {lines:,}行（最終登録: {last_converted or '-'}）")
+        st.button(
+            "変換履歴を消去する", on_click=clear_ledger, args=(conn,),
+            help="新しい会計年度で伝票No.が振り直された場合などに使います。"
+        )
+
+
+def convert_many(job, files, db_path):
+    """
+    複数のファイル（ファイル名と内容の一覧）をCPUコア数分のプロセスで並列に変換し、(ファイル名とCSVの一覧, 集計表) を返す。
+    バックグラウンドで実行し、ファイルごとに job へ進捗を報告する
+    """
+    total = len(files)
+    workers = max(1, min(total, os.cpu_count() or 1))
+    job.report(0, total)
+    outputs = [None] * total
+    summary = [None] * total
+    with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT,
+                             initializer=init_worker, initargs=(db_path,)) as executor:
+        futures = {executor.submit(convert_uploaded_bytes, name, data): i for i, (name, data) in enumerate(files)}
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                name = files[i][0]
+                try:
+                    data, stats = future.result()
+                    outputs[i] = (name, data)
+                    summary[i] = {"ファイル": name, "結果": "OK", "件数": stats["rows"],
+                                  "マスタ未登録の行": stats["unmapped"], "日付変換不可": stats["unparsed_dates"]}
+                except Exception as e:
+                    summary[i] = {"ファイル": name, "結果": f"エラー: {e}"}
+                job.report(done, stage=name)
+        except JobCancelled:
+            # 取り消された場合は未着手のファイルを変換しない（変換中のファイルは終わるまで待つ）
+            executor.shutdown(cancel_futures=True)
+            raise
+
+    # 一覧・集計表はアップロードした順に並べる（エラーの行は件数が空欄になるため整数型にそろえる）
+    summary = pd.DataFrame(summary)
+    for column in ["件数", "マスタ未登録の行", "日付変換不可"]:
+        if column in summary:
+            summary[column] = summary[column].astype("Int64")
+    return [output for output in outputs if output is not None], summary
+
+
+def build_zip(outputs):
+    """ 変換後のCSVを「元のファイル名_R4.csv」としてZIPにまとめる（同名のファイルには連番を付ける） """
+    buffer = io.BytesIO()
+    used = set()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in outputs:
+            zf.writestr(output_file_name(name, used), data)
+    return buffer.getvalue()
+
+
+# 大容量ファイルは分割して変換する（プレビューは表示しない）
+chunked_mode = st.checkbox("大容量ファイルを分割して変換する（CSVのみ・プレビューなし）")
+# 年初からの累計の仕訳を毎月変換する場合に、前月までに変換した伝票を除いて出力する
+incremental_mode = st.checkbox(
+    "変換済みの仕訳を除いて出力する（変換履歴と照合・1ファイルのみ）", key="henkan_incremental", disabled=chunked_mode
+)
+# 無効にしたチェックボックスは直前の値を返すため、分割変換のときは使わない（出力とCSVの書き出しの両方でこの値を使う）
+incremental = incremental_mode and not chunked_mode
+
+# 変換が遅い場合の原因調査用（無効時は計測を行わない）
+with st.expander("🔧 診断（処理時間・プロファイル）"):
+    show_timings = st.checkbox("段階ごとの処理時間と行数を表示する", key="henkan_diag_timings")
+    capture_profile = st.checkbox("cProfile でプロファイルを取得する（変換をやり直します）", key="henkan_diag_profile")
+diagnostics_level = 2 if capture_profile else (1 if show_timings else 0)
 
 if uploaded_file and uploaded_file.size > 0:
-    if "conn" not in st.session_state:
+    if not os.path.isfile(st.session_state.get("db_path", "")):
         st.error("データベースが未接続です。menu.pyで接続してください。")
-    else:
-        conn = st.session_state.conn
-        df = load_file(uploaded_file)
-        df["日付"] = pd.to_datetime(df["日付"], errors="coerce").dt.date
-
-        # 借方勘定科目が欠損している行に"諸口"を入力し、借方金額を貸方金額で補完
-        mask_kari_empty = df["借方勘定科目"].isna()
-        df.loc[mask_kari_empty, "借方勘定科目"] = "諸口"
-        df.loc[mask_kari_empty, "借方金額"] = df.loc[mask_kari_empty, "貸方金額"]
-
-        # 貸方勘定科目が欠損している行にも同様に"諸口"と補完処理
-        mask_kashi_empty = df["貸方勘定科目"].isna()
-        df.loc[mask_kashi_empty, "貸方勘定科目"] = "諸口"
-        df.loc[mask_kashi_empty, "貸方金額"] = df.loc[mask_kashi_empty, "借方金額"]
-
-        # 借方補助科目または貸方補助科目が「賃貸収入」の場合、補助科目を空欄にし勘定科目を賃貸収入に変更
-        df.loc[df["借方補助科目"] == "賃貸収入", "借方勘定科目"] = "賃貸収入"
-        df.loc[df["借方補助科目"] == "賃貸収入", "借方補助科目"] = ""
-        
-        df.loc[df["貸方補助科目"] == "賃貸収入", "貸方勘定科目"] = "賃貸収入"
-        df.loc[df["貸方補助科目"] == "賃貸収入", "貸方補助科目"] = ""
-
-        st.write("弥生会計形式 仕訳データプレビュー")
-        st.dataframe(df)
-    
-        def get_accounting_data():
-            query = "SELECT 財務R4科目コード, 財務R4科目名, 弥生会計科目名 FROM kamoku_master"
-            return pd.read_sql(query, conn)
-
-        accounting_data = get_accounting_data()
-
-        df_book = pd.DataFrame(columns=[
-            "月種別", "種類", "形式", "作成方法", "付箋", "伝票日付", "伝票番号", "伝票摘要", "枝番",
-            "借方部門", "借方部門名", "借方科目", "借方科目名", "借方補助", "借方補助科目名", "借方金額",
-            "借方消費税コード", "借方消費税業種", "借方消費税税率", "借方資金区分", "借方任意項目１",
-            "借方任意項目２", "借方インボイス情報", "貸方部門", "貸方部門名", "貸方科目", "貸方科目名",
-            "貸方補助", "貸方補助科目名", "貸方金額", "貸方消費税コード", "貸方消費税業種",
-            "貸方消費税税率", "貸方資金区分", "貸方任意項目１", "貸方任意項目２", "貸方インボイス情報",
-            "摘要", "期日", "証番号", "入力マシン", "入力ユーザ", "入力アプリ", "入力会社", "入力日付"
-        ])
-
-        df_book["伝票日付"] = df["日付"]
-        df_book["摘要"] = df["摘要"]
-        df_book["伝票番号"] = df["伝票No."]
-
-        for i, row in df.iterrows():
-            for col in ["借方", "貸方"]:
-                yayoi_account = row[f"{col}勘定科目"]
-                matched_row = accounting_data[accounting_data["弥生会計科目名"] == yayoi_account]
-                if not matched_row.empty:
-                    df_book.at[i, f"{col}科目"] = matched_row["財務R4科目コード"].values[0]
-                    df_book.at[i, f"{col}科目名"] = matched_row["財務R4科目名"].values[0]
-            df_book.at[i, "借方金額"] = row["借方金額"]
-            df_book.at[i, "貸方金額"] = row["貸方金額"]
-
-        def get_tax_data():
-            query = """
-            SELECT 財務R4税コード, 財務R4税率, 財務R4インボイス, 財務R4簡易課税, 弥生会計税区分
-            FROM syouhizei_master
-            """
-            return pd.read_sql(query, conn)
-
-        tax_data = get_tax_data()
-
-        for i, row in df.iterrows():
-            for col in ["借方", "貸方"]:
-                yayoi_tax = row[f"{col}税区分"]
-                matched_row = tax_data[tax_data["弥生会計税区分"] == yayoi_tax]
-                if not matched_row.empty:
-                    df_book.at[i, f"{col}消費税コード"] = matched_row["財務R4税コード"].values[0]
-                    df_book.at[i, f"{col}消費税税率"] = matched_row["財務R4税率"].values[0]
-                    df_book.at[i, f"{col}インボイス情報"] = matched_row["財務R4インボイス"].values[0]   
-                    df_book.at[i, f"{col}消費税業種"] = matched_row["財務R4簡易課税"].values[0]  
-
-
-        def update_df_book(df, df_book):
-            query_hojo = """
-            SELECT 管理番号, 財務R4科目コード, 財務R4科目名, 財務R4補助科目コード, 
-                   財務R4補助科目名, 弥生会計補助科目名 
-            FROM hojo_master
-            """
-            df_hojo_db = pd.read_sql_query(query_hojo, conn)
-
-            for index, row in df_book.iterrows():
-                # 借方の処理
-                debit_account = row['借方科目名']
-                debit_sub_account = df.loc[index, '貸方補助科目']
-                match_debit = df_hojo_db[(df_hojo_db['財務R4科目名'] == debit_account) & 
-                                        (df_hojo_db['弥生会計補助科目名'] == debit_sub_account)]
-                
-                if not match_debit.empty:
-                    df_book.loc[index, '借方補助'] = match_debit['財務R4補助科目コード'].values[0]
-                    df_book.loc[index, '借方補助科目名'] = match_debit['財務R4補助科目名'].values[0]
-                elif debit_account == '商品売上高':
-                    df_book.loc[index, '借方補助'] = '19'   
-                    df_book.loc[index, '借方補助科目名'] = 'その他'  
-                elif debit_account in ['材料仕入高', 'C消耗品費', 'C外注加工費']:
-                    df_book.loc[index, '借方補助'] = '99'   
-                    df_book.loc[index, '借方補助科目名'] = 'その他'  
-                else:
-                    df_book.loc[index, '借方補助'] = '0'  # マッチしない場合は "0"
-                    df_book.loc[index, '借方補助科目名'] = ''  # マッチしない場合は 空欄
-                
-                # 貸方の処理
-                credit_account = row['貸方科目名']
-                credit_sub_account = df.loc[index, '借方補助科目']
-                match_credit = df_hojo_db[(df_hojo_db['財務R4科目名'] == credit_account) & 
-                                        (df_hojo_db['弥生会計補助科目名'] == credit_sub_account)]
-                
-                if not match_credit.empty:
-                    df_book.loc[index, '貸方補助'] = match_credit['財務R4補助科目コード'].values[0]
-                    df_book.loc[index, '貸方補助科目名'] = match_credit['財務R4補助科目名'].values[0]
-                elif credit_account == '商品売上高':
-                    df_book.loc[index, '貸方補助'] = '19'  
-                    df_book.loc[index, '貸方補助科目名'] = 'その他' 
-                elif credit_account in ['材料仕入高', 'C消耗品費', 'C外注加工費']:
-                    df_book.loc[index, '借方補助'] = '99'   
-                    df_book.loc[index, '借方補助科目名'] = 'その他'  
-                else:
-                    df_book.loc[index, '貸方補助'] = '0'  # マッチしない場合は "0"
-                    df_book.loc[index, '貸方補助科目名'] = ''  # マッチしない場合は 空欄
-                    
-            for index, row in df_book.iterrows():
-
-                # 借方科目の確認
-                debit_account = row['借方科目']
-                # 貸方科目の確認
-                credit_account = row['貸方科目']
-                
-                # 借方補助が空白の場合
-                if pd.isna(row['借方補助']) or row['借方補助'] == "":
-                    if debit_account == 810:
-                        df_book.loc[index, '借方補助'] = 19  # 810の場合
-                    elif debit_account in [401, 435, 448]:
-                        df_book.loc[index, '借方補助'] = 99  # 401, 435, 448の場合
-
-                # 貸方補助が空白の場合
-                if pd.isna(row['貸方補助']) or row['貸方補助'] == "":
-                    if credit_account == 810:
-                        df_book.loc[index, '貸方補助'] = 19  # 810の場合
-                    elif credit_account in [401, 435, 448]:
-                        df_book.loc[index, '貸方補助'] = 99  # 401, 435, 448の場合
-
-            return df_book
-
-        df_book = update_df_book(df, df_book)
-        st.write("R4形式 仕訳データプレビュー")
-        st.dataframe(df_book)
+        st.stop()
+    # 使用中のDBとして、一時ファイルの掃除の対象から外す
+    touch_temp_file(st.session_state.db_path)
 
+    csv_bytes = io.BytesIO()
+
+    if chunked_mode and uploaded_file.name.lower().endswith(".csv"):
+        masters = get_masters(st.session_state.db_path)
+        # 変換はバックグラウンドで行い、ダウンロードなどの再実行では変換し直さない
+        job = find_job("chunked", uploaded_file.file_id, masters, diagnostics_level)
+        if job is None:
+            # アップロードは一時ファイルに少しずつ書き出し、変換結果も一時ファイルに追記する
+            # （変換中にファイル全体や変換結果をメモリに持たない）
+            session_id = st.session_state.setdefault("storage_session_id", uuid.uuid4().hex)
+            source_path = store_upload(session_id, uploaded_file.name, uploaded_file, uploaded_file.file_id)
+            output_path = temp_file_path(
+                session_id, f"{os.path.splitext(uploaded_file.name)[0]}_R4.csv", uploaded_file.file_id
+            )
+            level = diagnostics_level
+
+            def convert_chunked(job):
+                # 総行数は改行の数からの概算（進捗の表示用）
+                job.report(0, count_lines(source_path), "分割変換")
+                rows, timings, profile = run_with_diagnostics(
+                    lambda timer: convert_csv_in_chunks(
+                        source_path, masters, output_path, timer=timer, progress=lambda rows: job.report(rows)
+                    ),
+                    level
+                )
+                return {"rows": rows, "csv_path": output_path, "timings": timings, "profile": profile}
+
+            job = start_job(
+                convert_chunked, "chunked", uploaded_file.file_id, masters, level, uploaded_file.name,
+                temp_paths=[source_path, output_path]
+            )
+        result = wait_for_job(job)
+        st.success(f"{result['rows']}件の仕訳を変換しました。")
+        if diagnostics_level:
+            show_diagnostics(result["timings"], result["profile"] if capture_profile else None)
+        # ダウンロードは一時ファイルから渡す（変換結果をメモリ上で複製しない）
+        csv_bytes = open(result["csv_path"], "rb")
+    else:
+        masters = get_masters(st.session_state.db_path)
+        # 変換結果はアップロードとマスタが変わるまで使い回す（ページ送りや絞り込みで変換し直さない）
+        # 診断や変換履歴との照合を有効にした場合は、計測済み・指紋を求めた結果がなければ変換し直す
+        result = st.session_state.get("henkan_result")
+        if (result is None or result["file_id"] != uploaded_file.file_id or result["masters"] is not masters
+                or result["diagnostics_level"] < diagnostics_level or (incremental and "fingerprints" not in result)):
+            # 変換はバックグラウンドで行う（実行中は進捗を表示し、再実行されても変換し直さない）
+            job = find_job("preview", uploaded_file.file_id, masters, diagnostics_level, incremental)
+            if job is None:
+                # 変換の前に、マスタ未登録の科目・税区分がないかを確認する
+                unmapped_keys = preflight_check(uploaded_file, masters)
+                upload = {
+                    "file_id": uploaded_file.file_id,
+                    "name": uploaded_file.name,
+                    "data": uploaded_file.getvalue(),
+                    "df": load_file(uploaded_file),
+                    "fingerprints": incremental,
+                }
+                level = diagnostics_level
+
+                def convert_preview(job):
+                    result, timings, profile = run_with_diagnostics(convert_upload, level, job, upload, masters)
+                    result["diagnostics_level"] = level
+                    result["timings"], result["profile"] = timings, profile
+                    result["unmapped_keys"] = unmapped_keys
+                    return result
+
+                job = start_job(
+                    convert_preview, "preview", uploaded_file.file_id, masters, level, uploaded_file.name,
+                    fingerprints=incremental
+                )
+            result = wait_for_job(job)
+            st.session_state.henkan_result = result
+
+        df, df_book = result["df"], result["df_book"]
+        unparsed_dates = df.attrs.get("unparsed_dates", [])
+        if unparsed_dates:
+            # 行番号はファイルの1行目を1とする
+            rows_text = "、".join(str(i + 1) for i in unparsed_dates[:20])
+            more = " ほか" if len(unparsed_dates) > 20 else ""
+            st.warning(f"日付を変換できなかった行が {len(unparsed_dates)} 件あります（{rows_text}行目{more}）。")
+
+        show_journal_summary(df, df_book, result["unmapped"])
+        if not result["unmapped_keys"].empty:
+            with st.expander("マスタ未登録の一覧"):
+                show_unmapped_keys(result["unmapped_keys"], key="henkan_unmapped_keys")
+        if diagnostics_level:
+            show_diagnostics(result["timings"], result["profile"] if capture_profile else None)
+        show_journal_preview(df, df_book, result["unmapped"], key="henkan_preview")
+        if not incremental:
+            csv_bytes.write(result["csv"])
 
     # SQLiteファイル名を取得
-    db_path = st.session_state.conn.execute("PRAGMA database_list").fetchone()[2]
+    db_path = st.session_state.db_path
     db_name = os.path.splitext(os.path.basename(db_path))[0]
 
     # 今日の日付を "YYYYMMDD" 形式で取得
@@ -291,15 +549,65 @@ if uploaded_file and uploaded_file.size > 0:
     # ファイル名を「DB名_作成日:YYYYMMDD.csv」の形式に
     file_name = f"{db_name}_作成日:{today}.csv"
 
-    # CSVをバイナリ形式でエクスポート（Excel文字化け回避のためutf-8-sig）
-    csv_bytes = io.BytesIO()
-    df_book.to_csv(csv_bytes, index=False, encoding="utf-8-sig")
+    if incremental:
+        exported = show_incremental(result, csv_bytes, f"{db_name}_作成日:{today}")
+
     csv_bytes.seek(0)
 
     # ダウンロードボタン
     st.download_button(
-        label="CSVをダウンロード",
+        label="新規の仕訳のCSVをダウンロード" if incremental else "CSVをダウンロード",
         data=csv_bytes,
         file_name=file_name,
         mime="application/octet-stream"
     )
+
+    if incremental:
+        show_ledger_actions(exported)
+
+
+elif len(uploaded_files) > 1:
+    if not os.path.isfile(st.session_state.get("db_path", "")):
+        st.error("データベースが未接続です。menu.pyで接続してください。")
+        st.stop()
+    # 使用中のDBとして、一時ファイルの掃除の対象から外す
+    touch_temp_file(st.session_state.db_path)
+
+    db_path = st.session_state.db_path
+    # ダウンロードなどの再実行では変換し直さない（ファイルかマスタが変わった場合のみ変換する）
+    batch_key = (tuple(f.file_id for f in uploaded_files), db_path)
+    masters = get_masters(db_path)
+    batch = st.session_state.get("henkan_batch_result")
+    if batch is None or batch["key"] != batch_key or batch["masters"] is not masters:
+        job = find_job("batch", batch_key, masters)
+        if job is None:
+            files = [(f.name, f.getvalue()) for f in uploaded_files]
+
+            def convert_batch(job):
+                outputs, summary = convert_many(job, files, db_path)
+                return {"key": batch_key, "masters": masters, "zip": build_zip(outputs), "summary": summary}
+
+            job = start_job(convert_batch, "batch", batch_key, masters, label=f"{len(files)}件のファイル", unit="件")
+        batch = wait_for_job(job)
+        st.session_state.henkan_batch_result = batch
+
+    summary = batch["summary"]
+    failed = (summary["結果"] != "OK").sum()
+    if failed:
+        st.error(f"{failed}件のファイルを変換できませんでした。")
+    else:
+        st.success(f"{len(summary)}件のファイルを変換しました。")
+    st.dataframe(summary, hide_index=True)
+
+    db_name = os.path.splitext(os.path.basename(db_path))[0]
+    today = datetime.today().strftime("%Y%m%d")
+    st.download_button(
+        label="ZIPをダウンロード",
+        data=batch["zip"],
+        file_name=f"{db_name}_作成日:{today}.zip",
+        mime="application/zip"
+    )
+
+else:
+    # 他のページから戻った場合など、アップロードがなければこのセッションの変換の進捗か結果を表示する
+    show_previous_job()
@@ -1,7 +1,8 @@
 import streamlit as st
-import sqlite3
+from connection_manager import get_connection
 import pandas as pd
-import chardet
+from file_encoding import detect_encoding
+from xlsx_reader import read_xlsx
 import io
 
 # StreamlitのUI設定
@@ -19,6 +20,7 @@ with st.sidebar:
     st.page_link("pages/setting_kamoku.py", label="科目設定")
     st.page_link("pages/setting_hojo.py", label="補助設定")
     st.page_link("pages/setting_syouhizei.py", label="消費税設定")
+    st.page_link("pages/setting_rules.py", label="変換ルール設定")
 
     # 初期設定（オレンジ系）
     st.markdown('<div class="section orange">データベースへのインポート</div>', unsafe_allow_html=True)
@@ -88,7 +90,7 @@ st.download_button(
 DB_NAME = "department.db"
 
 def get_db_connection():
-    return sqlite3.connect(DB_NAME)
+    return get_connection(DB_NAME)
 
 def create_table():
     """ 部門マスターのテーブル作成 (初回のみ) """
@@ -102,7 +104,6 @@ def create_table():
         )
     ''')
     conn.commit()
-    conn.close()
 
 # 初回起動時にテーブル作成
 create_table()
@@ -118,14 +119,13 @@ if uploaded_file is not None:
         if file_extension == "csv":
             uploaded_file.seek(0)  # ストリームをリセット
             raw_data = uploaded_file.read()
-            detected = chardet.detect(raw_data)
-            encoding = detected["encoding"] or "utf-8"  # エンコーディングの設定
+            encoding = detect_encoding(raw_data)  # エンコーディングの設定
 
             uploaded_file.seek(0)  # 再び先頭に戻す
-            df = pd.read_csv(io.BytesIO(raw_data), encoding=encoding, errors="replace")
+            df = pd.read_csv(io.BytesIO(raw_data), encoding=encoding, encoding_errors="replace")
         
         elif file_extension == "xlsx":
-            df = pd.read_excel(uploaded_file, engine="openpyxl")
+            df = read_xlsx(uploaded_file, header=0)
 
         if df is not None:
             df.columns = df.columns.str.strip()
@@ -156,13 +156,11 @@ if uploaded_file is not None:
                     ''', (row["財務R4部門コード"], row["財務R4部門名"], row["弥生会計部門名"]))
 
                 conn.commit()
-                conn.close()
                 st.success("データベースに保存しました！")
 
             # データベースの内容を表示
             conn = get_db_connection()
             df_db = pd.read_sql_query("SELECT * FROM department_master", conn)
-            conn.close()
             st.write("データベースの内容")
             st.dataframe(df_db)
         else:
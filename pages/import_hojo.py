@@ -1,10 +1,12 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-import chardet
+from file_encoding import detect_encoding
+from xlsx_reader import read_xlsx
+from database import bulk_upsert, upsert_summary, initialize_tables
+from db_download import database_download_button
+from session_db import get_session_connection
 import io
 import os
-from datetime import datetime
 
 # ページ設定
 st.set_page_config(layout="wide")
@@ -21,6 +23,7 @@ with st.sidebar:
     st.page_link("pages/setting_kamoku.py", label="&nbsp;&nbsp;勘定科目設定")
     st.page_link("pages/setting_hojo.py", label="&nbsp;&nbsp;補助科目設定")
     st.page_link("pages/setting_syouhizei.py", label="&nbsp;&nbsp;消費税設定")
+    st.page_link("pages/setting_rules.py", label="&nbsp;&nbsp;変換ルール設定")
 
     st.markdown('<div class="section orange">データベースへのインポート</div>', unsafe_allow_html=True)
     st.page_link("pages/import_kamoku.py", label="&nbsp;&nbsp;勘定科目マスタインポート")
@@ -72,30 +75,10 @@ st.download_button(
     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 )
 
-# DB接続
-def get_db_connection():
-    if "conn" not in st.session_state:
-        if "db_path" not in st.session_state or not st.session_state.db_path:
-            st.error("「データベース接続」でデータベースに接続してください。")
-            st.stop()
-        st.session_state.conn = sqlite3.connect(st.session_state.db_path, check_same_thread=False)
-    return st.session_state.conn
-
-conn = get_db_connection()
-
-# テーブル作成（なければ）
-def create_table():
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS hojo_master (
-        管理番号 TEXT PRIMARY KEY,
-        財務R4科目コード TEXT NOT NULL,
-        財務R4科目名 TEXT NOT NULL,
-        財務R4補助科目コード TEXT NOT NULL,
-        財務R4補助科目名 TEXT,
-        弥生会計補助科目名 TEXT)''')
-    conn.commit()
-
-create_table()
+conn = get_session_connection()
+
+# テーブル作成・スキーマ更新（なければ）
+initialize_tables(conn)
 
 # 接続中DBパス表示
 st.info(f"現在接続中のデータベース: {st.session_state.get('db_path')}")
@@ -119,10 +102,10 @@ if uploaded_file:
     try:
         if file_extension == "csv":
             raw_data = uploaded_file.read()
-            encoding = chardet.detect(raw_data)["encoding"] or "utf-8"
-            df = pd.read_csv(io.BytesIO(raw_data), encoding=encoding, errors="replace")
+            encoding = detect_encoding(raw_data)
+            df = pd.read_csv(io.BytesIO(raw_data), encoding=encoding, encoding_errors="replace")
         elif file_extension == "xlsx":
-            df = pd.read_excel(uploaded_file, engine="openpyxl")
+            df = read_xlsx(uploaded_file, header=0)
 
         if df is not None:
             df.columns = df.columns.str.strip()
@@ -141,16 +124,11 @@ if uploaded_file:
 
             if st.button("💾 データベースに保存"):
                 try:
-                    cursor = conn.cursor()
-                    for row in df.to_dict(orient="records"):
-                        cursor.execute('''INSERT OR REPLACE INTO hojo_master
-                            (管理番号, 財務R4科目コード, 財務R4科目名, 財務R4補助科目コード, 財務R4補助科目名, 弥生会計補助科目名)
-                            VALUES (?, ?, ?, ?, ?, ?)''', (
-                            row["管理番号"], row["財務R4科目コード"], row["財務R4科目名"],
-                            row["財務R4補助科目コード"], row["財務R4補助科目名"], row["弥生会計補助科目名"]
-                        ))
-                    conn.commit()
-                    st.success("データベースに保存しました！")
+                    counts = bulk_upsert(conn, "hojo_master", df, [
+                        "管理番号", "財務R4科目コード", "財務R4科目名",
+                        "財務R4補助科目コード", "財務R4補助科目名", "弥生会計補助科目名"
+                    ])
+                    st.success(f"データベースに保存しました！（{upsert_summary(counts)}）")
                     st.session_state["refresh_hojo"] = True
                 except Exception as db_error:
                     st.error(f"データベース保存時にエラーが発生しました: {db_error}")
@@ -173,18 +151,4 @@ if st.session_state.get("refresh_hojo"):
 
 # DBファイルのダウンロード
 if "db_path" in st.session_state and os.path.isfile(st.session_state.db_path):
-    db_path = st.session_state.db_path
-    db_filename = os.path.basename(db_path)
-    db_name, db_ext = os.path.splitext(db_filename)
-    today = datetime.today().strftime("%Y%m%d")
-    download_name = f"{db_name}_{today}{db_ext}"
-
-    with open(db_path, "rb") as f:
-        db_bytes = f.read()
-
-    st.download_button(
-        label="💾 現在のデータベースを保存（デスクトップへ）",
-        data=db_bytes,
-        file_name=download_name,
-        mime="application/octet-stream"
-    )
+    database_download_button(st.session_state.db_path, label="💾 現在のデータベースを保存（デスクトップへ）", key="import_hojo_db")
@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
+from connection_manager import get_connection
 
 # ページ設定
 st.set_page_config(layout="wide")
@@ -16,6 +16,7 @@ with st.sidebar:
     st.page_link("pages/setting_kamoku.py", label="&nbsp;&nbsp;勘定科目設定")
     st.page_link("pages/setting_hojo.py", label="&nbsp;&nbsp;補助科目設定")
     st.page_link("pages/setting_syouhizei.py", label="&nbsp;&nbsp;消費税設定")
+    st.page_link("pages/setting_rules.py", label="&nbsp;&nbsp;変換ルール設定")
 
     st.markdown('<div class="section orange">データベースへのインポート</div>', unsafe_allow_html=True)
     st.page_link("pages/import_kamoku.py", label="&nbsp;&nbsp;勘定科目マスタインポート")
@@ -57,7 +58,7 @@ st.markdown("""
 
 # データベース接続用の関数を定義
 def get_db_connection(db_name):
-    return sqlite3.connect(db_name, check_same_thread=False)
+    return get_connection(db_name)
 
 st.title("部門設定")
 
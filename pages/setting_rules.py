@@ -0,0 +1,117 @@
+import streamlit as st
+import os
+from database import apply_editor_changes
+from db_download import database_download_button
+from henkan_core import compile_conversion_rules
+from henkan_rules import RULE_COLUMNS, read_rules, reset_rules
+from session_db import get_session_connection
+
+# ページ設定
+st.set_page_config(layout="wide")
+
+with st.sidebar:
+    st.markdown('<div class="section red">データベース接続</div>', unsafe_allow_html=True)
+    st.page_link("menu.py", label="&nbsp;&nbsp;データベース接続")
+
+    st.markdown('<div class="section blue">処理項目</div>', unsafe_allow_html=True)
+    st.page_link("pages/henkan.py", label="&nbsp;&nbsp;仕訳変換")
+
+    st.markdown('<div class="section green">設定変更</div>', unsafe_allow_html=True)
+    st.page_link("pages/setting_kamoku.py", label="&nbsp;&nbsp;勘定科目設定")
+    st.page_link("pages/setting_hojo.py", label="&nbsp;&nbsp;補助科目設定")
+    st.page_link("pages/setting_syouhizei.py", label="&nbsp;&nbsp;消費税設定")
+    st.page_link("pages/setting_rules.py", label="&nbsp;&nbsp;変換ルール設定")
+
+    st.markdown('<div class="section orange">データベースへのインポート</div>', unsafe_allow_html=True)
+    st.page_link("pages/import_kamoku.py", label="&nbsp;&nbsp;勘定科目マスタインポート")
+    st.page_link("pages/import_hojo.py", label="&nbsp;&nbsp;補助科目マスタインポート")
+    st.page_link("pages/import_syouhizei.py", label="&nbsp;&nbsp;消費税マスタインポート")
+
+st.markdown("""
+    <style>
+    .section {
+        font-size: 16px;
+        font-weight: bold;
+        padding: 8px 12px;
+        margin: 15px 0 8px 0;
+        border-radius: 8px;
+        border: 2px solid;
+    }
+    .blue {
+        color: #1f77b4;
+        border-color: #1f77b4;
+        background-color: #e6f0fa;
+    }
+    .green {
+        color: #2ca02c;
+        border-color: #2ca02c;
+        background-color: #e9f7ea;
+    }
+    .orange {
+        color: #ff7f0e;
+        border-color: #ff7f0e;
+        background-color: #fff4e6;
+    }
+    .red {
+        color: #d62728;
+        border-color: #d62728;
+        background-color: #fdecea;
+    }
+    </style>
+""", unsafe_allow_html=True)
+
+
+# タイトル表示
+st.title("変換ルール設定")
+
+# 接続
+conn = get_session_connection()
+st.info(f"接続中のDB: {st.session_state.get('db_path')}")
+
+st.markdown("""
+仕訳変換の特例（諸口の補完・賃貸収入の科目振替・補助の既定値など）を設定します。
+ルールは「順序」の小さいものから、仕訳全体に対してまとめて適用されます。
+
+- **段階**: 仕訳（弥生会計形式の仕訳。科目の割り当て前）／補助科目（財務R4形式の仕訳。補助科目の照合後）
+- **貸借**: 借方・貸方・両方。列名の `{貸借}` はこの側、`{相手}` は反対側に置き換わります（両方は借方、貸方の順に適用）
+- **条件**: 空欄・空欄以外・一致・不一致・いずれか（条件値を「、」区切りで指定）。条件列2 も指定すると両方を満たす行が対象です
+- **設定方法**: 値（設定値を入れる）・列（設定値に指定した列の値を写す）・空欄（値を消す）
+- 補助科目の段階では「借方補助照合」「貸方補助照合」（一致／不一致）で、補助科目がマスタにあったかどうかを条件にできます
+""")
+
+# --- データ読み込み ---
+df_db = read_rules(conn)
+df_edit = df_db.copy()
+df_edit["有効"] = df_edit["有効"].fillna(1).astype(bool)
+edited_df = st.data_editor(
+    df_edit,
+    num_rows="dynamic",
+    use_container_width=True,
+    hide_index=True,
+    key="rules_editor",
+    disabled=["管理番号"]  # 管理番号は編集不可
+)
+
+if st.button("変更を保存"):
+    try:
+        # 保存する前に、すべてのルールが変換に使える形になっているかを確認する
+        compile_conversion_rules(edited_df)
+    except ValueError as e:
+        st.error(str(e))
+    else:
+        # 変更・追加・削除された行だけを反映する
+        counts = apply_editor_changes(conn, "henkan_rules", df_edit, st.session_state["rules_editor"], RULE_COLUMNS)
+        st.success(
+            f"変更を保存しました（更新 {counts['updated']} 件 / 追加 {counts['added']} 件 / "
+            f"削除 {counts['deleted']} 件）。ページを再読み込みしてください。"
+        )
+
+with st.expander("既定のルールに戻す"):
+    st.warning("追加・変更したルールはすべて削除されます。")
+    if st.button("既定のルールに戻す"):
+        reset_rules(conn)
+        st.success("既定のルールに戻しました。ページを再読み込みしてください。")
+
+# --- データベースファイルのダウンロードボタン（接続DB名 + 日付） ---
+if "db_path" in st.session_state and os.path.isfile(st.session_state.db_path):
+    database_download_button(st.session_state.db_path, label="💾 データベースを保存（デスクトップへ）", key="setting_rules_db")
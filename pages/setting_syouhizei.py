@@ -1,9 +1,10 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import uuid
 import os
-from datetime import datetime
+from database import apply_editor_changes, delete_rows
+from db_download import database_download_button
+from session_db import get_session_connection
 
 # ページ設定
 st.set_page_config(layout="wide")
@@ -19,6 +20,7 @@ with st.sidebar:
     st.page_link("pages/setting_kamoku.py", label="&nbsp;&nbsp;勘定科目設定")
     st.page_link("pages/setting_hojo.py", label="&nbsp;&nbsp;補助科目設定")
     st.page_link("pages/setting_syouhizei.py", label="&nbsp;&nbsp;消費税設定")
+    st.page_link("pages/setting_rules.py", label="&nbsp;&nbsp;変換ルール設定")
 
     st.markdown('<div class="section orange">データベースへのインポート</div>', unsafe_allow_html=True)
     st.page_link("pages/import_kamoku.py", label="&nbsp;&nbsp;勘定科目マスタインポート")
@@ -67,16 +69,7 @@ with st.expander("弥生会計の消費税情報"):
 with st.expander("財務R4の消費税情報"):
     st.markdown("[財務R4サポートページ](https://faq.r4support.epson.jp/app/answers/detail/a_id/5144)")
 
-# DB接続（menu.pyと共通化）
-def get_db_connection():
-    if "conn" not in st.session_state:
-        if "db_path" not in st.session_state or not st.session_state.db_path:
-            st.error("「データベース接続」でDBに接続してください")
-            st.stop()
-        st.session_state.conn = sqlite3.connect(st.session_state.db_path, check_same_thread=False)
-    return st.session_state.conn
-
-conn = get_db_connection()
+conn = get_session_connection()
 cursor = conn.cursor()
 st.info(f"接続中のDB: {st.session_state.get('db_path')}")
 
@@ -104,27 +97,19 @@ with tab1:
         rows_to_delete = edited_df[edited_df["削除"] == True]
         if not rows_to_delete.empty:
             if st.button("選択した行を削除"):
-                for code in rows_to_delete["管理番号"]:
-                    cursor.execute("DELETE FROM syouhizei_master WHERE 管理番号 = ?", (code,))
-                conn.commit()
+                delete_rows(conn, "syouhizei_master", rows_to_delete["管理番号"])
                 st.success("削除しました。ページを再読み込みしてください。")
 
         if st.button("変更を保存"):
-            for _, row in edited_df.iterrows():
-                cursor.execute("""
-                    UPDATE syouhizei_master SET 
-                        財務R4税コード = ?, 
-                        財務R4税率 = ?, 
-                        財務R4インボイス = ?, 
-                        財務R4簡易課税 = ?, 
-                        弥生会計税区分 = ?
-                    WHERE 管理番号 = ?
-                """, (
-                    row["財務R4税コード"], row["財務R4税率"], row["財務R4インボイス"],
-                    row["財務R4簡易課税"], row["弥生会計税区分"], row["管理番号"]
-                ))
-            conn.commit()
-            st.success("変更を保存しました。ページを再読み込みしてください。")
+            # 変更・追加・削除された行だけを反映する
+            counts = apply_editor_changes(
+                conn, "syouhizei_master", df_edit, st.session_state["tax_data_editor"],
+                ["管理番号", "財務R4税コード", "財務R4税率", "財務R4インボイス", "財務R4簡易課税", "弥生会計税区分"]
+            )
+            st.success(
+                f"変更を保存しました（更新 {counts['updated']} 件 / 追加 {counts['added']} 件 / "
+                f"削除 {counts['deleted']} 件）。ページを再読み込みしてください。"
+            )
 
 with tab2:
     st.subheader("新規税区分の追加")
@@ -157,18 +142,4 @@ with tab2:
 
 # --- データベースダウンロードボタン（接続中のDB名＋日付） ---
 if "db_path" in st.session_state and os.path.isfile(st.session_state.db_path):
-    db_path = st.session_state.db_path
-    db_filename = os.path.basename(db_path)
-    db_name, db_ext = os.path.splitext(db_filename)
-    today = datetime.today().strftime("%Y%m%d")
-    download_name = f"{db_name}_{today}{db_ext}"
-
-    with open(db_path, "rb") as f:
-        db_bytes = f.read()
-
-    st.download_button(
-        label="💾 データベースを保存（デスクトップへ）",
-        data=db_bytes,
-        file_name=download_name,
-        mime="application/octet-stream"
-    )
+    database_download_button(st.session_state.db_path, label="💾 データベースを保存（デスクトップへ）", key="setting_syouhizei_db")
@@ -0,0 +1,17 @@
+import os
+
+import streamlit as st
+
+from connection_manager import get_connection
+from temp_storage import touch_temp_file
+
+
+def get_session_connection():
+    """ 「データベース接続」で接続したDBへの接続を返す（未接続の場合はメッセージを表示してページを止める） """
+    db_path = st.session_state.get("db_path")
+    if not db_path or not os.path.isfile(db_path):
+        st.error("「データベース接続」でデータベースに接続してください。")
+        st.stop()
+    # 使用中のDBとして、一時ファイルの掃除の対象から外す
+    touch_temp_file(db_path)
+    return get_connection(db_path)
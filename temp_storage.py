@@ -0,0 +1,207 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# アップロードされたデータベースを置く一時ディレクトリ（OSの一時ディレクトリの下）
+TEMP_DIR_NAME = "yayoi_r4"
+# 最終更新から一定時間たったファイルは放棄されたものとして削除する
+DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60
+# 合計サイズが上限を超えた場合は古いものから削除する
+DEFAULT_MAX_TOTAL_BYTES = 2 * 1024 ** 3
+# この時間内に使われたファイルは使用中とみなし、合計サイズが上限を超えても削除しない
+# （他のセッションが接続中のDBを消さないため。各ページは接続のたびに touch する）
+DEFAULT_IDLE_SECONDS = 2 * 60 * 60
+# 掃除を行う最短の間隔（再実行のたびにディレクトリを走査しない）
+DEFAULT_CLEANUP_INTERVAL_SECONDS = 10 * 60
+
+# アップロードを書き込む単位
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# SQLite がデータベースと同じ場所に作るファイル
+_SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+_PARTIAL_SUFFIX = ".uploading"
+
+
+def file_digest(f):
+    """ ファイルオブジェクトの内容のハッシュ値を、全体を一度に読み込まずに求める（読み込み位置は先頭に戻す） """
+    f.seek(0)
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+        h.update(chunk)
+    f.seek(0)
+    return h.hexdigest()
+
+
+def file_signature(path):
+    """ ファイルの更新時刻と大きさ。ジャーナル（-wal）への書き込みも変更として扱う """
+    signature = []
+    for target in (path, path + "-wal"):
+        if os.path.exists(target):
+            stat = os.stat(target)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class TempFileManager:
+    """ 一時ディレクトリ内のファイルを、経過時間と合計サイズの上限に従って削除する（プロセス全体で共有） """
+
+    def __init__(self, root=None, max_age_seconds=DEFAULT_MAX_AGE_SECONDS, max_total_bytes=DEFAULT_MAX_TOTAL_BYTES,
+                 idle_seconds=DEFAULT_IDLE_SECONDS, cleanup_interval_seconds=DEFAULT_CLEANUP_INTERVAL_SECONDS):
+        self.root = root or os.path.join(tempfile.gettempdir(), TEMP_DIR_NAME)
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+        self.idle_seconds = idle_seconds
+        self.cleanup_interval_seconds = cleanup_interval_seconds
+        self._lock = threading.Lock()
+        self._last_cleanup = None
+
+    def upload_path(self, session_id, name, digest):
+        """ アップロードの保存先。セッションごと・内容ごとに別のディレクトリにする """
+        return os.path.join(self.root, session_id, digest, os.path.basename(name))
+
+    def store_upload(self, session_id, name, f, digest):
+        """ アップロードされたファイルを少しずつ書き込み、保存先のパスを返す """
+        path = self.upload_path(session_id, name, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = path + _PARTIAL_SUFFIX
+        f.seek(0)
+        try:
+            with open(partial_path, "wb") as out:
+                shutil.copyfileobj(f, out, UPLOAD_CHUNK_SIZE)
+            # 書き込みが完了してから置き換える（書き込み途中のファイルに接続しない）
+            for suffix in _SIDECAR_SUFFIXES:
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return path
+
+    def discard(self, path):
+        """ 保存したファイルを付随ファイルごと削除する（削除できなければ掃除に任せる） """
+        if self._is_managed(path):
+            self._remove(os.path.abspath(path))
+
+    def touch(self, path):
+        """
+        使用中のファイルを経過時間による削除の対象から外す。
+        ファイル自体の更新時刻は変更を検知するために使うため、置き場所のディレクトリの時刻を更新する
+        """
+        if os.path.isfile(path) and self._is_managed(path):
+            os.utime(os.path.dirname(path))
+
+    def maybe_cleanup(self, keep=()):
+        """ 前回の掃除から一定時間たっていれば掃除する """
+        with self._lock:
+            now = time.monotonic()
+            if self._last_cleanup is not None and now - self._last_cleanup < self.cleanup_interval_seconds:
+                return []
+            self._last_cleanup = now
+        return self.cleanup(keep)
+
+    def cleanup(self, keep=()):
+        """
+        古いファイル、および合計サイズの上限を超えた分を古い順に削除し、削除したパスを返す。
+        上限を超えた分の削除は、idle_seconds 以上使われていないファイルに限る（他のセッションが使用中のDBは残す）
+        """
+        if not os.path.isdir(self.root):
+            return []
+        keep = {os.path.abspath(p) for p in keep}
+
+        groups = self._file_groups()
+        now = time.time()
+        removed = []
+        idle = []
+        total = 0
+        for path, mtime, size in sorted(groups, key=lambda g: g[1]):
+            if path in keep:
+                total += size
+            elif now - mtime > self.max_age_seconds:
+                removed += self._remove(path)
+            else:
+                total += size
+                if now - mtime > self.idle_seconds:
+                    idle.append((path, size))
+
+        for path, size in idle:
+            if total <= self.max_total_bytes:
+                break
+            removed += self._remove(path)
+            total -= size
+        return removed
+
+    def _file_groups(self):
+        # データベース本体と -wal などの付随ファイルをまとめて1件として扱う（更新時刻はディレクトリを含めて最も新しいもの）
+        groups = {}
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                base = os.path.abspath(os.path.join(dir_path, file_name))
+                stat = os.stat(base)
+                for suffix in _SIDECAR_SUFFIXES + (_PARTIAL_SUFFIX,):
+                    if base.endswith(suffix):
+                        base = base[:-len(suffix)]
+                        break
+                mtime, size = groups.get(base, (os.stat(dir_path).st_mtime, 0))
+                groups[base] = (max(mtime, stat.st_mtime), size + stat.st_size)
+        return [(path, mtime, size) for path, (mtime, size) in groups.items()]
+
+    def _remove(self, path):
+        removed = []
+        for target in (path,) + tuple(path + suffix for suffix in _SIDECAR_SUFFIXES + (_PARTIAL_SUFFIX,)):
+            try:
+                os.remove(target)
+                removed.append(target)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Windows では他のセッションが開いているファイルは削除できない。次回の掃除に回す
+                pass
+        self._remove_empty_dirs(os.path.dirname(path))
+        return removed
+
+    def _remove_empty_dirs(self, dir_path):
+        root = os.path.abspath(self.root)
+        while os.path.abspath(dir_path) != root and self._is_managed(dir_path):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                break
+            dir_path = os.path.dirname(dir_path)
+
+    def _is_managed(self, path):
+        root, path = os.path.abspath(self.root), os.path.abspath(path)
+        try:
+            return path != root and os.path.commonpath([root, path]) == root
+        except ValueError:
+            # Windows でドライブが異なる
+            return False
+
+
+_manager = TempFileManager()
+
+
+def store_upload(session_id, name, f, digest):
+    return _manager.store_upload(session_id, name, f, digest)
+
+
+def temp_file_path(session_id, name, digest):
+    """ セッション用の作業ファイルのパス（置き場所のディレクトリは作成済み。アップロードと同じく掃除の対象になる） """
+    path = _manager.upload_path(session_id, name, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def discard_upload(path):
+    _manager.discard(path)
+
+
+def touch_temp_file(path):
+    _manager.touch(path)
+
+
+def cleanup_temp_files(keep=()):
+    return _manager.maybe_cleanup(keep)
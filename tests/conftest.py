@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+from database import initialize_tables
+from henkan_core import load_masters
+
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+
+# テスト用のマスタ（弥生会計科目名, 財務R4科目コード, 財務R4科目名）
+KAMOKU_ROWS = [
+    ("現金", "101", "現金"),
+    ("普通預金", "131", "普通預金"),
+    ("売掛金", "151", "売掛金"),
+    ("仮払消費税", "190", "仮払消費税"),
+    ("未払金", "320", "未払金"),
+    ("材料仕入高", "401", "材料仕入高"),
+    ("C消耗品費", "435", "C消耗品費"),
+    ("C外注加工費", "448", "C外注加工費"),
+    ("雑費", "490", "雑費"),
+    ("商品売上高", "810", "商品売上高"),
+    ("賃貸収入", "820", "賃貸収入"),
+    ("諸口", "999", "諸口"),
+]
+# (財務R4科目コード, 財務R4科目名, 財務R4補助科目コード, 財務R4補助科目名, 弥生会計補助科目名)
+HOJO_ROWS = [
+    ("131", "普通預金", "1", "A銀行", "A銀行"),
+    ("131", "普通預金", "2", "B銀行", "B銀行"),
+    ("151", "売掛金", "5", "得意先X", "得意先X"),
+    ("101", "現金", "3", "小口現金", "B銀行"),
+]
+# (財務R4税コード, 財務R4税率, 財務R4インボイス, 財務R4簡易課税, 弥生会計税区分)
+SYOUHIZEI_ROWS = [
+    ("10", "10", "1", None, "課税売上10%"),
+    ("12", "8", "0", "2", "課税売上8%(軽)"),
+    ("20", None, None, None, "課対仕入10%"),
+    ("0", None, None, None, "対象外"),
+]
+
+
+@pytest.fixture
+def master_db(tmp_path):
+    """ テスト用のマスタを登録した最新スキーマのデータベース """
+    path = str(tmp_path / "masters.db")
+    conn = sqlite3.connect(path)
+    initialize_tables(conn)
+    with conn:
+        conn.executemany(
+            "INSERT INTO kamoku_master VALUES (?, ?, ?, ?)",
+            [(str(i), code, name, yayoi) for i, (yayoi, code, name) in enumerate(KAMOKU_ROWS)]
+        )
+        conn.executemany("INSERT INTO hojo_master VALUES (?, ?, ?, ?, ?, ?)", [(str(i),) + r for i, r in enumerate(HOJO_ROWS)])
+        conn.executemany(
+            "INSERT INTO syouhizei_master VALUES (?, ?, ?, ?, ?, ?)", [(str(i),) + r for i, r in enumerate(SYOUHIZEI_ROWS)]
+        )
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def masters(master_db):
+    return load_masters(master_db)
@@ -0,0 +1,14 @@
+import database
+from database import check_database_integrity
+
+
+def test_integrity_results_keep_only_recent_digests(master_db, monkeypatch):
+    db_path = master_db.execute("PRAGMA database_list").fetchone()[2]
+    master_db.commit()
+    monkeypatch.setattr(database, "INTEGRITY_CACHE_SIZE", 2)
+    monkeypatch.setattr(database, "_integrity_results", database.OrderedDict())
+
+    for digest in ["a", "b", "a", "c"]:
+        assert check_database_integrity(db_path, digest) == []
+    # 最後に使った順に2件だけが残る
+    assert list(database._integrity_results) == ["a", "c"]
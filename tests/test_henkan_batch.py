@@ -0,0 +1,29 @@
+import os
+import shutil
+
+from conftest import FIXTURES_DIR
+from henkan_batch import main, plan_output_paths
+
+JOURNAL_PATH = os.path.join(FIXTURES_DIR, "yayoi_journal.csv")
+
+
+def test_same_named_inputs_get_distinct_outputs(tmp_path, master_db):
+    # 別のディレクトリの同名のファイルは連番で区別して、両方を出力する
+    for client in ["client_a", "client_b"]:
+        (tmp_path / client).mkdir()
+        shutil.copy(JOURNAL_PATH, tmp_path / client / "仕訳.csv")
+    output_dir = tmp_path / "out"
+    db_path = master_db.execute("PRAGMA database_list").fetchone()[2]
+
+    assert main(["--db", db_path, "--output-dir", str(output_dir), str(tmp_path / "client_a"), str(tmp_path / "client_b")]) == 0
+    assert sorted(os.listdir(output_dir)) == ["仕訳_2_R4.csv", "仕訳_R4.csv"]
+    with open(os.path.join(FIXTURES_DIR, "expected_r4.csv"), "rb") as f:
+        expected = f.read()
+    for name in os.listdir(output_dir):
+        assert (output_dir / name).read_bytes() == expected
+
+
+def test_output_names_avoid_inputs_and_case_collisions(tmp_path):
+    files = [tmp_path / "a.csv", tmp_path / "a.xlsx", tmp_path / "A.csv", tmp_path / "a_R4.csv"]
+    outputs = plan_output_paths(files, tmp_path)
+    assert [p.name for p in outputs] == ["a_2_R4.csv", "a_3_R4.csv", "A_4_R4.csv", "a_R4_R4.csv"]
@@ -0,0 +1,78 @@
+import datetime
+import io
+import os
+
+import pandas as pd
+
+from conftest import FIXTURES_DIR
+from henkan_core import (
+    read_yayoi_file, normalize_journal, convert_journal, write_r4_csv, convert_csv_in_chunks, convert_journal_in_batches,
+    parse_journal_dates
+)
+
+JOURNAL_PATH = os.path.join(FIXTURES_DIR, "yayoi_journal.csv")
+EXPECTED_PATH = os.path.join(FIXTURES_DIR, "expected_r4.csv")
+
+
+def convert_fixture(masters):
+    df = read_yayoi_file(JOURNAL_PATH, "yayoi_journal.csv")
+    normalize_journal(df, masters["rules"])
+    return df, convert_journal(df, masters)
+
+
+def expected_bytes():
+    with open(EXPECTED_PATH, "rb") as f:
+        return f.read()
+
+
+def test_convert_journal_matches_expected_csv(masters):
+    _, df_book = convert_fixture(masters)
+    output = io.BytesIO()
+    write_r4_csv(df_book, output)
+    assert output.getvalue() == expected_bytes()
+
+
+def test_sub_account_matches_opposite_side(masters):
+    # 借方科目には貸方の補助科目を照合する（伝票1: 普通預金 × A銀行）
+    _, df_book = convert_fixture(masters)
+    row = df_book[df_book["伝票番号"] == 1].iloc[0]
+    assert row["借方補助"] == "1"
+    assert row["借方補助科目名"] == "A銀行"
+    assert row["貸方補助"] == "0"
+
+
+def test_credit_side_sonota_account_sets_debit_sub_account(masters):
+    # 貸方が材料仕入高の場合は借方補助を 99 その他にし、貸方補助は設定しない（伝票5）
+    _, df_book = convert_fixture(masters)
+    row = df_book[df_book["伝票番号"] == 5].iloc[0]
+    assert row["貸方科目名"] == "材料仕入高"
+    assert (row["借方補助"], row["借方補助科目名"]) == ("99", "その他")
+    assert pd.isna(row["貸方補助"]) and pd.isna(row["貸方補助科目名"])
+
+
+def test_chunked_and_batched_conversion_match(masters):
+    chunked = io.BytesIO()
+    convert_csv_in_chunks(JOURNAL_PATH, masters, chunked, chunksize=4)
+    assert chunked.getvalue() == expected_bytes()
+
+    df = read_yayoi_file(JOURNAL_PATH, "yayoi_journal.csv")
+    normalize_journal(df, masters["rules"])
+    batched = io.BytesIO()
+    convert_journal_in_batches(df, masters, batched, batch_rows=3)
+    assert batched.getvalue() == expected_bytes()
+
+
+def test_parse_journal_dates_converts_eras_and_gregorian_forms():
+    values = ["R.06/04/01", "H.31/04/30", "S.64/01/07", "2024/04/01", "2024-4-1 10:00", "20240401", None]
+    dates, unparsed = parse_journal_dates(values)
+    assert list(dates[:6]) == [
+        datetime.date(2024, 4, 1), datetime.date(2019, 4, 30), datetime.date(1989, 1, 7),
+        datetime.date(2024, 4, 1), datetime.date(2024, 4, 1), datetime.date(2024, 4, 1),
+    ]
+    assert pd.isna(dates[6])
+    assert not unparsed.any()
+
+
+def test_parse_journal_dates_reports_invalid_dates():
+    _, unparsed = parse_journal_dates(["20241301", "24/04/01", "R.06/02/30", "不明", ""])
+    assert list(unparsed) == [True, True, True, True, False]
@@ -0,0 +1,67 @@
+import shutil
+import threading
+
+import pandas as pd
+
+import master_cache
+from henkan_ledger import clear_ledger, record_entries
+from master_cache import MasterCache
+
+
+def database_path(conn):
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def test_returns_cached_masters_until_masters_change(master_db):
+    cache = MasterCache()
+    db_path = database_path(master_db)
+    masters = cache.get(db_path)
+    assert cache.get(db_path) is masters
+
+    with master_db:
+        master_db.execute("UPDATE kamoku_master SET 財務R4科目名 = '現金預金' WHERE 財務R4科目コード = '101'")
+    assert cache.get(db_path) is not masters
+
+
+def test_ledger_writes_keep_cached_masters(master_db):
+    cache = MasterCache()
+    db_path = database_path(master_db)
+    masters = cache.get(db_path)
+
+    record_entries(master_db, pd.DataFrame({"伝票番号": [1, 1], "行番号": [1, 2], "指紋": [11, 12]}))
+    assert cache.get(db_path) is masters
+    clear_ledger(master_db)
+    assert cache.get(db_path) is masters
+
+    with master_db:
+        master_db.execute("UPDATE henkan_rules SET 有効 = 0")
+    assert cache.get(db_path) is not masters
+
+
+def test_slow_load_does_not_block_other_databases(master_db, tmp_path, monkeypatch):
+    slow_path = database_path(master_db)
+    other_path = str(tmp_path / "other.db")
+    shutil.copy(slow_path, other_path)
+    cache = MasterCache()
+    cache.get(other_path)
+
+    loading, release = threading.Event(), threading.Event()
+    load_masters = master_cache.load_masters
+
+    def slow_load(conn):
+        loading.set()
+        release.wait(10)
+        return load_masters(conn)
+
+    monkeypatch.setattr(master_cache, "load_masters", slow_load)
+    thread = threading.Thread(target=cache.get, args=(slow_path,))
+    thread.start()
+    try:
+        assert loading.wait(10)
+        # 読み込み中の別のデータベースがあっても、キャッシュ済みのマスタはすぐに返る
+        finished = threading.Event()
+        threading.Thread(target=lambda: (cache.get(other_path), finished.set())).start()
+        assert finished.wait(2)
+    finally:
+        release.set()
+        thread.join(10)
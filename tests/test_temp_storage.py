@@ -0,0 +1,35 @@
+import os
+import time
+
+from temp_storage import TempFileManager
+
+
+def write_upload(manager, session_id, size, age_seconds):
+    path = manager.upload_path(session_id, "my_database.db", "digest")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    mtime = time.time() - age_seconds
+    os.utime(path, (mtime, mtime))
+    os.utime(os.path.dirname(path), (mtime, mtime))
+    return path
+
+
+def test_size_cap_keeps_databases_in_use_by_other_sessions(tmp_path):
+    manager = TempFileManager(root=str(tmp_path), max_total_bytes=1500, idle_seconds=60 * 60)
+    current = write_upload(manager, "current", 1000, 0)
+    other = write_upload(manager, "other", 1000, 10 * 60)
+    abandoned = write_upload(manager, "abandoned", 1000, 3 * 60 * 60)
+
+    removed = manager.cleanup(keep=[current])
+    assert removed == [abandoned]
+    # 上限を超えたままでも、使用中のDBは削除しない
+    assert os.path.exists(current) and os.path.exists(other)
+
+
+def test_touch_marks_database_in_use(tmp_path):
+    manager = TempFileManager(root=str(tmp_path), max_total_bytes=0, idle_seconds=60 * 60)
+    path = write_upload(manager, "other", 1000, 3 * 60 * 60)
+    manager.touch(path)
+    assert manager.cleanup() == []
+    assert os.path.exists(path)
@@ -0,0 +1,126 @@
+import io
+import re
+import zipfile
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import xlsx_reader
+from xlsx_reader import read_xlsx, clear_xlsx_cache
+
+SHEET_PATH = "xl/worksheets/sheet1.xml"
+
+
+def workbook_bytes(rows, iso_dates=False):
+    wb = openpyxl.Workbook(iso_dates=iso_dates)
+    ws = wb.active
+    for row in rows:
+        ws.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def rewrite_sheet(data, rewrite):
+    # ワークシートのXMLだけを書き換えたXLSXを作る
+    src = zipfile.ZipFile(io.BytesIO(data))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            content = src.read(item.filename)
+            if item.filename == SHEET_PATH:
+                content = rewrite(content.decode("utf-8")).encode("utf-8")
+            dst.writestr(item, content)
+    return buffer.getvalue()
+
+
+def read_both(data, header=None):
+    clear_xlsx_cache()
+    expected = pd.read_excel(io.BytesIO(data), header=header)
+    return expected, read_xlsx(io.BytesIO(data), header=header)
+
+
+@pytest.fixture
+def no_fallback(monkeypatch):
+    """ pd.read_excel への切り替えを禁止する（高速な読み込みで読めていることを確かめる） """
+    def fail(*args, **kwargs):
+        raise AssertionError("pd.read_excel で読み直しました")
+    return lambda: monkeypatch.setattr(xlsx_reader.pd, "read_excel", fail)
+
+
+JOURNAL_ROWS = [
+    ["識別フラグ", "伝票No.", "取引日付", "借方勘定科目", "借方金額", "摘要"],
+    [2000, 1, datetime(2024, 4, 1), "普通預金", 110000, "売掛金の入金 & 振込"],
+    [2000, 1, datetime(2024, 4, 1), None, 0.5, None],
+    [2000, 2, "R.06/04/02", "売掛金", 55000, "<商品>の売上"],
+]
+
+
+@pytest.mark.parametrize("header", [None, 0])
+def test_matches_read_excel(header, no_fallback):
+    data = workbook_bytes(JOURNAL_ROWS)
+    clear_xlsx_cache()
+    expected = pd.read_excel(io.BytesIO(data), header=header)
+    no_fallback()
+    pd.testing.assert_frame_equal(read_xlsx(io.BytesIO(data), header=header), expected)
+
+
+def test_prefixed_namespace_tags_fall_back_instead_of_reading_empty():
+    def add_prefix(xml):
+        xml = xml.replace("<worksheet ", '<worksheet xmlns:x="http://schemas.openxmlformats.org/spreadsheetml/2006/main" ', 1)
+        return re.sub(r"<(/?)(sheetData|row|c|v)\b", r"<\1x:\2", xml)
+
+    data = rewrite_sheet(workbook_bytes(JOURNAL_ROWS), add_prefix)
+    expected, actual = read_both(data)
+    assert not actual.empty
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_integers_beyond_int64_do_not_overflow(no_fallback):
+    data = workbook_bytes([["a", 1e20, 5], ["b", 3, 2 ** 63], ["c", -1e19, 7]])
+    clear_xlsx_cache()
+    expected = pd.read_excel(io.BytesIO(data), header=None)
+    no_fallback()
+    actual = read_xlsx(io.BytesIO(data), header=None)
+    pd.testing.assert_frame_equal(actual, expected)
+    assert actual.loc[0, 1] == 1e20
+
+
+def test_large_integer_in_text_column_stays_exact(no_fallback):
+    data = workbook_bytes([["a"], [10 ** 20], [1]])
+    clear_xlsx_cache()
+    expected = pd.read_excel(io.BytesIO(data), header=None)
+    no_fallback()
+    actual = read_xlsx(io.BytesIO(data), header=None)
+    pd.testing.assert_frame_equal(actual, expected)
+    assert actual.loc[1, 0] == 10 ** 20
+
+
+def test_changed_openpyxl_internals_fall_back(monkeypatch):
+    data = workbook_bytes(JOURNAL_ROWS)
+    def changed(*args, **kwargs):
+        raise AttributeError("_date_formats")
+    # pd.read_excel は openpyxl の apply_stylesheet をそのまま使うため、こちらだけを差し替える
+    monkeypatch.setattr(xlsx_reader, "apply_stylesheet", changed)
+    expected, actual = read_both(data)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_iso_date_cells_fall_back_instead_of_dropping():
+    # iso_dates=True では日時が t="d" のセル（ISO 8601 の文字列）として保存される
+    data = workbook_bytes(JOURNAL_ROWS, iso_dates=True)
+    assert 't="d"' in zipfile.ZipFile(io.BytesIO(data)).read(SHEET_PATH).decode("utf-8")
+    expected, actual = read_both(data, header=0)
+    pd.testing.assert_frame_equal(actual, expected)
+    assert actual.loc[0, "取引日付"] == datetime(2024, 4, 1)
+
+
+def test_error_cells_read_as_blank(no_fallback):
+    data = workbook_bytes([["a", 1, "#N/A"], ["b", "#DIV/0!", 2]])
+    assert 't="e"' in zipfile.ZipFile(io.BytesIO(data)).read(SHEET_PATH).decode("utf-8")
+    clear_xlsx_cache()
+    expected = pd.read_excel(io.BytesIO(data), header=None)
+    no_fallback()
+    pd.testing.assert_frame_equal(read_xlsx(io.BytesIO(data), header=None), expected)
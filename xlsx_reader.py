@@ -0,0 +1,328 @@
+import codecs
+import hashlib
+import io
+import re
+import threading
+from collections import OrderedDict
+from html import unescape
+
+import numpy as np
+import pandas as pd
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.utils import column_index_from_string
+
+# 読み込み結果を保持するファイル数（内容のハッシュ値ごと。大きな DataFrame を保持するため少なめ）
+CACHE_SIZE = 4
+
+# シートのXMLを分割して読み込む単位
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# 行の開始タグ（行番号）、またはセル（列名・型とスタイルを含む属性・値・インライン文字列）
+# 属性の並びが想定と異なる行・セルは一致しないため、タグの数の照合で検出して pd.read_excel に切り替える
+_TOKEN = re.compile(
+    r'<row r="(\d+)"[^>]*>'
+    r'|<c r="([A-Z]+)\d+"([^>]*?)'
+    r'(?:/>|>(?:<f\b[^>]*?(?:/>|>[^<]*</f>))?(?:<v>([^<]*)</v>|<v ?/>)?'
+    r'(?:<is><t(?: [^>]*)?>([^<]*)</t></is>|<is>(.*?)</is>)?</c>)',
+    re.S
+)
+# 名前空間の接頭辞（<x:row> など）の有無にかかわらず、行・セルの開始タグ
+_ROW_TAG = re.compile(r"<(?:\w+:)?row\b")
+_CELL_TAG = re.compile(r"<(?:\w+:)?c\b")
+_TYPE = re.compile(r'\bt="(\w+)"')
+_STYLE = re.compile(r'\bs="(\d+)"')
+_TEXT = re.compile(r"<t\b[^>]*>([^<]*)</t>")
+_PHONETIC = re.compile(r"<rPh\b.*?</rPh>", re.S)
+
+# Excel の1900年基準の日付で、存在しない1900/2/29 より前の値は1日ずれる
+_LEAP_BUG_SERIAL = 60
+
+# int64 で表せる整数の範囲（これを超える整数値は int64 にしない）
+_INT64_LIMIT = 2.0 ** 63
+
+# 一括変換に対応しているセルの型（t属性。数値・共有文字列・数式の文字列・インライン文字列・真偽値・エラー値）
+_CELL_TYPES = {"n", "s", "str", "inlineStr", "b", "e"}
+
+
+class _UnsupportedSheet(Exception):
+    # 高速な読み込みに対応していない形式（pd.read_excel で読み直す）
+    pass
+
+
+def _read_bytes(source):
+    if hasattr(source, "read"):
+        source.seek(0)
+        data = source.read()
+        source.seek(0)
+        return data
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def _open_workbook(data):
+    # ワークシート以外（共有文字列・ブック・スタイル）だけを openpyxl の読み取り専用モードで読み込む。
+    # ExcelReader の各段階と日付の書式の一覧は openpyxl の内部のため、形式が変わった場合は pd.read_excel で読み直す
+    try:
+        reader = ExcelReader(io.BytesIO(data), read_only=True, data_only=True, keep_links=False)
+        reader.read_manifest()
+        reader.read_strings()
+        reader.read_workbook()
+        apply_stylesheet(reader.archive, reader.wb)
+        reader.wb._date_formats
+    except (AttributeError, TypeError) as e:
+        raise _UnsupportedSheet(f"openpyxl の内部の形式が想定と異なります: {e}")
+    for sheet, rel in reader.parser.find_sheets():
+        if rel.target in reader.valid_files and "chartsheet" not in rel.Type:
+            return reader, rel.target
+    raise _UnsupportedSheet("ワークシートがありません。")
+
+
+def _iter_blocks(src):
+    # 行の途中で切れないよう、最後の </row> までを1つのブロックとして返す
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    rest = ""
+    while True:
+        data = src.read(BLOCK_SIZE)
+        text = rest + decoder.decode(data, final=not data)
+        if not data:
+            yield text
+            return
+        cut = text.rfind("</row>")
+        if cut < 0:
+            rest = text
+            continue
+        cut += len("</row>")
+        yield text[:cut]
+        rest = text[cut:]
+
+
+def _count_tags(block, pattern, name):
+    # タグの数。接頭辞付きのタグ（"<x:row" など）がありそうな場合だけ正規表現で数える
+    if f":{name}" in block:
+        return len(pattern.findall(block))
+    return block.count(f"<{name} ") + block.count(f"<{name}>") + block.count(f"<{name}/>")
+
+
+def _scan_cells(src):
+    # シートのXMLから (行番号（0始まり）, 列名, 属性, 値, インライン文字列, インライン文字列（書式付き）) の表を作る
+    frames = []
+    for block in _iter_blocks(src):
+        tokens = _TOKEN.findall(block)
+        frame = pd.DataFrame(tokens, columns=["row", "column", "attrs", "value", "text", "rich_text"])
+        is_row = (frame["row"] != "").to_numpy()
+        row_count = int(is_row.sum())
+        # 読み取れなかった行・セル（名前空間の接頭辞付きのタグなど）があれば、空のシートとして扱わずに読み直す
+        if (row_count != _count_tags(block, _ROW_TAG, "row")
+                or len(frame) - row_count != _count_tags(block, _CELL_TAG, "c")):
+            raise _UnsupportedSheet("行またはセルの形式が想定と異なります。")
+        if not tokens:
+            continue
+        # セルの行番号は直前の行の開始タグの番号
+        row_numbers = frame["row"].to_numpy()[is_row].astype(np.int64) - 1
+        frame["row"] = row_numbers[np.cumsum(is_row) - 1]
+        frames.append(frame[~is_row])
+    if not frames:
+        return pd.DataFrame(columns=["row", "column", "attrs", "value", "text", "rich_text"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _cell_values(cells, shared_strings, workbook):
+    # セルの型（t属性）ごとに値をまとめて変換する。
+    # 戻り値は (値（object 型、空のセルは None）, 数値のセルの値（float64、数値以外のセルは NaN）)
+    attrs = pd.Series(pd.unique(cells["attrs"]))
+    types = dict(zip(attrs, attrs.str.extract(_TYPE, expand=False).fillna("n")))
+    styles = dict(zip(attrs, attrs.str.extract(_STYLE, expand=False).fillna("0").astype(int)))
+    unknown = set(types.values()) - _CELL_TYPES
+    if unknown:
+        # ISO 8601 形式の日時（t="d"）など。pd.read_excel で読み直す
+        raise _UnsupportedSheet(f"対応していないセルの型があります: {', '.join(sorted(unknown))}")
+    cell_type = cells["attrs"].map(types).to_numpy()
+    raw = cells["value"].to_numpy(dtype=object)
+    has_value = raw != ""
+    values = np.full(len(cells), None, dtype=object)
+    numbers = np.full(len(cells), np.nan)
+
+    is_number = (cell_type == "n") & has_value
+    if is_number.any():
+        try:
+            number_values = raw[is_number].astype(np.float64)
+        except ValueError:
+            raise _UnsupportedSheet("数値として読めないセルがあります。")
+        numbers[is_number] = number_values
+        values[is_number] = _integral_objects(number_values)
+        # 日付の書式のセルは日時にする
+        is_date = is_number & cells["attrs"].map(styles).isin(workbook._date_formats).to_numpy()
+        if is_date.any():
+            values[is_date] = _excel_dates(numbers[is_date], workbook.epoch)
+            numbers[is_date] = np.nan
+
+    is_shared = (cell_type == "s") & has_value
+    values[is_shared] = np.array(shared_strings, dtype=object)[raw[is_shared].astype(int)]
+
+    is_formula_text = cell_type == "str"
+    values[is_formula_text] = _unescape(raw[is_formula_text])
+
+    is_inline = cell_type == "inlineStr"
+    inline = cells["text"].to_numpy(dtype=object)
+    is_rich = is_inline & (cells["rich_text"] != "").to_numpy()
+    # 書式付き・ふりがな付きの文字列はテキスト部分だけをつなげる
+    inline[is_rich] = ["".join(_TEXT.findall(_PHONETIC.sub("", text))) for text in cells["rich_text"][is_rich]]
+    values[is_inline] = _unescape(inline[is_inline])
+
+    is_boolean = (cell_type == "b") & has_value
+    values[is_boolean] = raw[is_boolean] == "1"
+
+    # 空の文字列とエラー値（t="e"）は空欄として扱う
+    values[values == ""] = None
+    return values, numbers
+
+
+def _unescape(texts):
+    return np.array([unescape(text) if "&" in text else text for text in texts], dtype=object)
+
+
+def _integral_objects(numbers):
+    # 整数値の数値は int にする（pd.read_excel と同じ）。int64 の範囲外の値は1つずつ int にする
+    objects = numbers.astype(object)
+    integral = np.isfinite(numbers) & (numbers == np.floor(numbers))
+    small = integral & (np.abs(numbers) < _INT64_LIMIT)
+    objects[small] = numbers[small].astype(np.int64).astype(object)
+    large = integral & ~small
+    objects[large] = [int(number) for number in numbers[large]]
+    return objects
+
+
+def _excel_dates(serials, epoch):
+    # openpyxl.utils.datetime.from_excel と同じ変換（ミリ秒単位に丸める）を一括で行う
+    if (serials < 1).any():
+        # 時刻だけの値（datetime.time になる）
+        raise _UnsupportedSheet("時刻だけのセルがあります。")
+    days = np.floor(serials)
+    milliseconds = np.round((serials - days) * 86_400_000)
+    if epoch.year == 1899:
+        days = days + (days < _LEAP_BUG_SERIAL)
+    dates = pd.Timestamp(epoch) + pd.to_timedelta(days, unit="D") + pd.to_timedelta(milliseconds, unit="ms")
+    return np.array(dates.to_pydatetime(), dtype=object)
+
+
+def _number_column(numbers):
+    # 数値のセルだけの列。空欄がなく整数だけなら int64、それ以外は float64。
+    # int64 の範囲外の整数を含む場合は、pd.read_excel と同じく int の値から型を決める（uint64 または float64）
+    if not np.isnan(numbers).any() and (numbers == np.floor(numbers)).all():
+        if (np.abs(numbers) < _INT64_LIMIT).all():
+            return numbers.astype(np.int64)
+        return pd.to_numeric(_integral_objects(numbers))
+    return numbers
+
+
+def _typed_column(values):
+    # pd.read_excel と同じく、数値に変換できる列は数値型、日時だけの列は日時型にする
+    if pd.api.types.infer_dtype(values, skipna=True) == "datetime":
+        return pd.to_datetime(values)
+    try:
+        return pd.to_numeric(values)
+    except (ValueError, TypeError):
+        column = pd.Series(values, dtype=object)
+        return column.where(column.notna(), np.nan)
+
+
+def _column_names(header_values):
+    # 空欄の見出しは「Unnamed: 列番号」、重複する見出しには「.1」「.2」… を付ける（pandas と同じ）
+    counts = {}
+    names = []
+    for i, name in enumerate(header_values):
+        if name is None:
+            name = f"Unnamed: {i}"
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        names.append(name)
+    return names
+
+
+def _parse_xlsx(data, header):
+    reader, sheet_path = _open_workbook(data)
+    with reader.archive.open(sheet_path) as src:
+        cells = _scan_cells(src)
+    values, numbers = _cell_values(cells, reader.shared_strings, reader.wb)
+
+    # 最後の値のある行・列までを読み込む。途中の空欄だけの行は残す（pd.read_excel と同じ）
+    present = pd.notna(values)
+    rows = cells["row"].to_numpy()[present]
+    columns = cells["column"].map(
+        {letters: column_index_from_string(letters) - 1 for letters in pd.unique(cells["column"])}
+    ).to_numpy()[present]
+    values, numbers = values[present], numbers[present]
+    if not len(values):
+        return pd.DataFrame()
+    width = int(columns.max()) + 1
+    row_count = int(rows.max()) + 1
+
+    names = list(range(width))
+    if header is not None:
+        # 1行目を見出しにする
+        if header != 0 or row_count == 1:
+            raise _UnsupportedSheet("見出しの行の指定に対応していません。")
+        is_header = rows == 0
+        if cells.loc[cells["row"] == 0, "attrs"].str.contains('t="e"').any():
+            # 見出しのエラー値は pd.read_excel では列名が NaN になる
+            raise _UnsupportedSheet("見出しにエラー値があります。")
+        header_values = np.full(width, None, dtype=object)
+        header_values[columns[is_header]] = values[is_header]
+        names = _column_names(header_values)
+        is_data = ~is_header
+        rows, columns, values, numbers = rows[is_data] - 1, columns[is_data], values[is_data], numbers[is_data]
+        row_count -= 1
+
+    frame = {}
+    for position, name in enumerate(names):
+        in_column = columns == position
+        column_rows = rows[in_column]
+        if not np.isnan(numbers[in_column]).any():
+            column_numbers = np.full(row_count, np.nan)
+            column_numbers[column_rows] = numbers[in_column]
+            frame[name] = _number_column(column_numbers)
+        else:
+            column_values = np.full(row_count, None, dtype=object)
+            column_values[column_rows] = values[in_column]
+            frame[name] = _typed_column(column_values)
+    return pd.DataFrame(frame, index=pd.RangeIndex(row_count))
+
+
+# 読み込み結果のキャッシュ（(内容のハッシュ値, header) → DataFrame）
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def read_xlsx(source, header=None):
+    """
+    XLSX の先頭のシートを DataFrame に読み込む（pd.read_excel(source, header=header) と同じ結果）。
+    シートのXMLをセルの表として一括で解析し、スタイルや数式の情報は読み込まない。
+    同じ内容のファイルは読み込み結果をキャッシュから返す（呼び出し元が変更してもよいよう複製を返す）
+    """
+    data = _read_bytes(source)
+    key = (hashlib.blake2b(data, digest_size=16).digest(), header)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key].copy()
+
+    try:
+        df = _parse_xlsx(data, header)
+    except _UnsupportedSheet:
+        df = pd.read_excel(io.BytesIO(data), header=header, engine="openpyxl")
+
+    with _cache_lock:
+        _cache[key] = df
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return df.copy()
+
+
+def clear_xlsx_cache():
+    with _cache_lock:
+        _cache.clear()